@@ -0,0 +1,136 @@
+# Headless HTTP API around the tutor engine, for running several workers behind a load balancer:
+#   uvicorn api:app --workers 4
+# Workers keep no conversation state: the client sends the transcript and the history state with every
+# question and gets the updated ones back. Indexes live in the shared on-disk vector store.
+import json
+from typing import Optional
+
+from fastapi import FastAPI, File, Header, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from engine import GREETING, TutorEngine, preamble_for
+from history import ChatHistory
+
+
+app = FastAPI(title="AI Tutor")
+engine = TutorEngine()
+
+
+class WebsitesRequest(BaseModel):
+    urls: list[str]
+    depth: int = 0
+    summarize: bool = False
+
+
+class Message(BaseModel):
+    role: str
+    text: str
+
+
+class HistoryState(BaseModel):
+    # The part of ChatHistory.to_dict() a client hands back. The token budget is the server's, not the client's.
+    summary: str = ""
+    folded: int = Field(0, ge=0)
+    sent_documents: dict[int, list[str]] = {}
+
+
+class AskRequest(BaseModel):
+    message: str
+    level: str = "High School"
+    source_ids: list[str] = []
+    # The transcript so far and the history state returned by the previous answer, empty for a new conversation
+    messages: list[Message] = []
+    history: Optional[HistoryState] = None
+    rerank: bool = False
+
+
+def load_history(state, messages):
+    # Only the greeting is never sent to the model, a transcript that starts elsewhere has nothing to skip
+    skip = 1 if messages[0] == {"role": "Chatbot", "text": GREETING} else 0
+    history = ChatHistory(skip=skip)
+    if state is not None:
+        history.summary = state.summary
+        history.folded = min(max(state.folded, skip), len(messages))
+        history.sent_documents = {index: set(keys) for index, keys in state.sent_documents.items()}
+    return history
+
+
+def start_turn(request, api_key, session=None):
+    messages = [message.model_dump() for message in request.messages] or [{"role": "Chatbot", "text": GREETING}]
+    history = load_history(request.history, messages)
+    turn = engine.start_turn(api_key, request.message, messages, history, preamble_for(request.level),
+                             request.source_ids, request.rerank, session=session)
+    return turn, messages, history
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"ok": True}
+
+
+# Both are empty unless the worker runs with CHATBOT_METRICS=1. Every worker keeps its own numbers,
+# scrape each one (or run a single worker) rather than going through the load balancer.
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return metrics.render_prometheus()
+
+
+@app.get("/sessions/{session_id}/metrics")
+async def session_metrics(session_id: str):
+    return metrics.session_report(session_id)
+
+
+@app.post("/sources/pdf")
+async def add_pdf(file: UploadFile = File(...), x_cohere_api_key: str = Header(...),
+                  x_session_id: Optional[str] = Header(None)):
+    data = await file.read()
+    # Returns as soon as the build has started, poll /sources/{source_id} for progress
+    pdf_index = await run_in_threadpool(engine.add_pdf, x_cohere_api_key, file.filename, data, x_session_id)
+    return engine.source_status(pdf_index.doc_id)
+
+
+@app.post("/sources/websites")
+async def add_websites(request: WebsitesRequest, x_cohere_api_key: str = Header(...),
+                       x_session_id: Optional[str] = Header(None)):
+    if not request.urls or not all(url.startswith(("http://", "https://")) for url in request.urls):
+        raise HTTPException(status_code=422, detail="Invalid URL format.")
+    web_index = await run_in_threadpool(engine.add_websites, x_cohere_api_key, request.urls, request.depth, x_session_id)
+    status = engine.source_status(web_index.doc_id)
+    if request.summarize:
+        status["summary"] = await run_in_threadpool(engine.summarize, x_cohere_api_key, web_index, x_session_id)
+    return status
+
+
+@app.get("/sources/{source_id}")
+async def source_status(source_id: str):
+    status = engine.source_status(source_id)
+    if not status["known"]:
+        raise HTTPException(status_code=404, detail="Unknown source.")
+    return status
+
+
+@app.post("/ask")
+async def ask(request: AskRequest, x_cohere_api_key: str = Header(...), x_session_id: Optional[str] = Header(None)):
+    def answer():
+        turn, messages, history = start_turn(request, x_cohere_api_key, x_session_id)
+        text = turn.complete()
+        return {"text": text, "messages": messages, "history": history.to_dict(), "timings": turn.timings()}
+    return await run_in_threadpool(answer)
+
+
+@app.post("/ask/stream")
+async def ask_stream(request: AskRequest, x_cohere_api_key: str = Header(...),
+                     x_session_id: Optional[str] = Header(None)):
+    # Newline-delimited JSON: {"text": ...} for every piece, then one {"done": true, ...} with the new state.
+    # Disconnecting closes the generator, which cancels the turn.
+    turn, messages, history = await run_in_threadpool(start_turn, request, x_cohere_api_key, x_session_id)
+
+    def events():
+        for text in turn.stream():
+            yield json.dumps({"text": text}) + "\n"
+        yield json.dumps({"done": True, "messages": messages, "history": history.to_dict(), "timings": turn.timings()}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
@@ -0,0 +1,231 @@
+# End-to-end benchmark of the tutor pipeline with the in-process fakes from fake_cohere.py standing in for the
+# Cohere SDK: API latency is simulated with sleeps, no HTTP or SDK overhead is measured
+#   python benchmark.py --label main
+#   python benchmark.py --label my-branch --compare benchmark_results/main.json
+# Synthetic PDFs go through extraction, chunking and indexing, then scripted conversations run through
+# retrieval and streaming chat. Reports p50/p95 per stage and peak memory, and saves the results as JSON.
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+WORDS = ("cell energy light plant water carbon oxygen membrane protein enzyme nucleus gene evolution species "
+         "force motion mass velocity energy atom molecule reaction acid base equation function graph vector").split()
+
+CONVERSATION = [
+    "Can you make me a study plan for this material?",
+    "What are the most important topics in chapter 2?",
+    "Explain how enzymes work in simple words.",
+    "Give me three practice questions about cell membranes.",
+    "What is the difference between velocity and acceleration?",
+    "Summarize what we have covered so far.",
+    "Which topics should I review again before the exam?",
+    "Can you explain the last point in more detail?",
+]
+
+
+def make_pdf(pages, seed=0):
+    import fitz # An alias for the PyMuPDF library.
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Chapter {page_num // 10 + 1} Section {page_num + 1}", fontsize=14)
+        y = 100
+        for _ in range(4):
+            sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "."
+                         for _ in range(5)]
+            page.insert_textbox(fitz.Rect(72, y, 520, y + 150), " ".join(sentences), fontsize=9)
+            y += 160
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class Recorder:
+    def __init__(self, trace_memory=False):
+        self.samples = {}
+        self.peaks = {}
+        self.trace_memory = trace_memory
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                self.peaks[name] = max(self.peaks.get(name, 0), peak)
+
+    def add(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def summary(self):
+        stages = {}
+        for name, samples in self.samples.items():
+            stages[name] = {"count": len(samples), "p50": percentile(samples, 50), "p95": percentile(samples, 95),
+                            "mean": statistics.fmean(samples)}
+            if name in self.peaks:
+                stages[name]["peak_traced_mb"] = self.peaks[name] / 1e6
+        return stages
+
+
+def run(args):
+    # Imported here so the cache directory set in main() is picked up
+    from embedding_cache import CACHE_DIR, CachedEmbeddings, EmbeddingCache
+    from engine import GREETING, TutorEngine, preamble_for
+    from fake_cohere import FakeChatClient, FakeEmbeddings
+    from history import ChatHistory
+    from pdf_ingest import chunk_page, iter_pages
+
+    class FakeEngine(TutorEngine):
+        def __init__(self):
+            super().__init__()
+            self.fake_embeddings = FakeEmbeddings(latency=args.embed_latency)
+            self.fake_chat = FakeChatClient(first_token_latency=args.first_token_latency,
+                                            token_latency=args.token_latency, latency=args.chat_latency)
+
+        def client(self, api_key):
+            return self.fake_chat
+
+        def embeddings(self, api_key, session=None):
+            return CachedEmbeddings(self.fake_embeddings, self.embedding_cache, "fake", session)
+
+    recorder = Recorder(args.trace_memory)
+    engine = FakeEngine()
+    counts = {}
+    source_ids = []
+    for pages in args.pages:
+        data = make_pdf(pages, seed=pages)
+        for repeat in range(args.repeat):
+            with recorder.stage(f"extract[{pages}p]"):
+                texts = list(iter_pages(data))
+            with recorder.stage(f"chunk[{pages}p]"):
+                chunks = [chunk for page_num, text in texts for chunk in chunk_page(page_num, text)]
+            counts[f"{pages}p"] = {"pages": pages, "chunks": len(chunks), "bytes": len(data)}
+            # Every repeat is a distinct document, otherwise the store would serve it without embedding
+            pdf = data + f"%{repeat}".encode() if repeat else data
+            # and its chunks are embedded again: repeats share their chunk texts, so a shared cache would
+            # turn every build after the first into cache hits
+            engine.embedding_cache = EmbeddingCache(os.path.join(CACHE_DIR, f"embeddings-{pages}-{repeat}.sqlite3"))
+            calls = engine.fake_embeddings.calls
+            with recorder.stage(f"index[{pages}p]"):
+                source_index = engine.add_pdf("fake", f"{pages}.pdf", pdf).wait()
+            source_ids.append(source_index.doc_id)
+            counts[f"{pages}p"]["embed_calls"] = engine.fake_embeddings.calls - calls
+        index_p50 = percentile(recorder.samples[f"index[{pages}p]"], 50)
+        counts[f"{pages}p"]["embed_chunks_per_second"] = len(chunks) / index_p50 if index_p50 else None
+
+    level = "High School"
+    for repeat in range(args.repeat):
+        messages = [{"role": "Chatbot", "text": GREETING}]
+        history = ChatHistory()
+        for prompt in CONVERSATION[:args.turns]:
+            with recorder.stage("retrieve"):
+                engine.retrieve("fake", prompt, source_ids)
+            started = time.perf_counter()
+            turn = engine.start_turn("fake", prompt, messages, history, preamble_for(level), source_ids)
+            recorder.add("turn_setup", time.perf_counter() - started)
+            for _ in turn.stream():
+                pass
+            timings = turn.timings()
+            if not timings["cached"]:
+                recorder.add("chat_ttft", timings["time_to_first_token"])
+                recorder.add("chat_generation", timings["total_time"])
+            recorder.add("chat_turn", time.perf_counter() - started)
+
+    return {
+        "stages": recorder.summary(),
+        "documents": counts,
+        "response_cache": engine.response_cache.stats(),
+        "embedding_calls": engine.fake_embeddings.calls,
+        "chat_calls": engine.fake_chat.calls,
+    }
+
+
+def compare(results, baseline, threshold):
+    print(f"\n{'stage':<24}{'p50 before':>12}{'p50 now':>12}{'change':>10}")
+    regressions = []
+    for name, now in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None or not before["p50"]:
+            continue
+        change = now["p50"] / before["p50"] - 1
+        flag = " !" if change > threshold else ""
+        print(f"{name:<24}{before['p50'] * 1000:>10.1f}ms{now['p50'] * 1000:>10.1f}ms{change:>+9.0%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the tutor pipeline with in-process fake Cohere clients")
+    parser.add_argument("--label", default=time.strftime("%Y%m%d-%H%M%S"))
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 400])
+    parser.add_argument("--turns", type=int, default=len(CONVERSATION))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=1.0)
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--trace-memory", action="store_true", help="per-stage peak Python memory, slows every stage down")
+    parser.add_argument("--output-dir", default="benchmark_results")
+    parser.add_argument("--compare", help="earlier results file to compare p50s against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50 slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Fresh caches, so every run measures cold ingestion
+        os.environ["CHATBOT_CACHE_DIR"] = cache_dir
+        if args.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        results = run(args)
+        results["wall_seconds"] = time.perf_counter() - started
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["peak_rss_mb"] = maxrss / (1e6 if sys.platform == "darwin" else 1e3)
+    results["label"] = args.label
+    results["config"] = {key: value for key, value in vars(args).items() if key not in ("compare", "output_dir")}
+    results["platform"] = {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+    print(f"{'stage':<24}{'n':>5}{'p50':>12}{'p95':>12}")
+    for name, stage in results["stages"].items():
+        print(f"{name:<24}{stage['count']:>5}{stage['p50'] * 1000:>10.1f}ms{stage['p95'] * 1000:>10.1f}ms")
+    print(f"peak RSS {results['peak_rss_mb']:.0f} MB, wall {results['wall_seconds']:.1f}s")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"{args.label}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"saved {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Streaming chat turns: tokens are handed to the UI as they arrive from client.chat_stream,
+# with time to first token and total generation time recorded for every turn
+import threading
+import time
+
+
+class ChatTurn:
+    def __init__(self):
+        self.text = ""
+        self.started = None
+        self.first_token_at = None
+        self.finished_at = None
+        self.cancelled = False
+        # Only a stream that reached stream-end without an error produced a whole answer
+        self.completed = False
+        self.error = None
+        self._cancel = threading.Event()
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started
+
+    @property
+    def total_time(self):
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started
+
+    def cancel(self):
+        self._cancel.set()
+
+    def stream(self, client, **chat_kwargs):
+        # A generator of text pieces, ready for st.write_stream. Closing it early (cancel(), or Streamlit
+        # stopping the script on a rerun) also closes the HTTP stream, so the model stops generating.
+        self.started = time.perf_counter()
+        events = client.chat_stream(**chat_kwargs)
+        try:
+            for event in events:
+                if self._cancel.is_set():
+                    self.cancelled = True
+                    break
+                if event.event_type == "text-generation":
+                    if self.first_token_at is None:
+                        self.first_token_at = time.perf_counter()
+                    self.text += event.text
+                    yield event.text
+                elif event.event_type == "stream-end":
+                    self.completed = True
+        except GeneratorExit:
+            self.cancelled = True
+            raise
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self.finished_at = time.perf_counter()
+            close = getattr(events, "close", None)
+            if close is not None:
+                close()
+
+    def timings(self):
+        return {"time_to_first_token": self.time_to_first_token, "total_time": self.total_time,
+                "cancelled": self.cancelled}
@@ -1,17 +1,14 @@
 # An example LLM chatbot using Cohere API and Streamlit that references a PDF
 # Adapted from the StreamLit OpenAI Chatbot example - https://github.com/streamlit/llm-examples/blob/main/Chatbot.py
-import json
+# The ingestion, retrieval and chat pipeline lives in engine.py, this file is only the UI around it
+import time
+import uuid
 import streamlit as st
-import cohere
-import fitz # An alias for the PyMuPDF library.
 
-from langchain.document_loaders import WebBaseLoader
-from langchain.indexes import VectorstoreIndexCreator
-from langchain_cohere.embeddings import CohereEmbeddings
-from langchain.chains import RetrievalQA
-from langchain.llms import Cohere
-from langchain.schema import Document
-from bs4 import BeautifulSoup
+import metrics
+from embedding_cache import content_hash
+from engine import EDUCATION_LEVELS, GREETING, TutorEngine, preamble_for
+from history import ChatHistory
 
 
 # Check if a valid Cohere API key is found in the .streamlit/secrets.toml file
@@ -28,6 +25,19 @@ if 'cohere_api_key' not in st.session_state:
     else:
         st.session_state.cohere_api_key = ''
 
+# One engine per Streamlit process: its caches, vector store and Cohere connections are shared by every session
+@st.cache_resource
+def get_engine():
+    return TutorEngine()
+
+engine = get_engine()
+
+# Per-stage timings are only collected when an admin asks for them, in secrets.toml or with CHATBOT_METRICS=1
+show_metrics = metrics.ENABLED or (hasattr(st, "secrets") and bool(st.secrets.get("ADMIN_METRICS", False)))
+if show_metrics and not metrics.ENABLED:
+    metrics.enable()
+session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+
 # Add a sidebar to the Streamlit app
 with st.sidebar:
 
@@ -37,70 +47,50 @@ with st.sidebar:
         st.session_state.cohere_api_key = st.text_input("Cohere API Key", key="chatbot_api_key", type="password")
         st.markdown("[Get a Cohere API Key](https://dashboard.cohere.ai/api-keys)")
 
-    def get_pdf_index(pdfs):
-        embeddings = CohereEmbeddings(cohere_api_key=st.session_state.cohere_api_key, model="embed-english-v3.0")
-        documents = [Document(page_content=pdf['snippet'], metadata={'title': pdf['title']}) for pdf in pdfs]
-        index = VectorstoreIndexCreator(embedding=embeddings).from_documents(documents)
-        return index
-
-    uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
-
-    if uploaded_file is not None:
-    # Create a temporary file-like object
-        with fitz.open(stream=uploaded_file.getvalue(), filetype="pdf") as doc:
-            PDFs = []
-            chunk_size = 1000
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                text = page.get_text()
-                part_num = 1
-                for i in range(0, len(text), chunk_size):
-                    PDFs.append({"title": f"Page {page_num + 1} Part {part_num}", "snippet": text[i:i + chunk_size]})
-                    part_num += 1
-        st.session_state['pdf_content'] = PDFs
-        pdf_index = get_pdf_index(PDFs)
-        st.session_state['pdf_index'] = pdf_index
+    uploaded_files = st.file_uploader("Choose PDF files", type="pdf", accept_multiple_files=True)
+
+    # Only parse and embed a PDF when its content changes, not on every rerun
+    pdf_hashes = st.session_state.setdefault('pdf_hashes', {})
+    pdf_indexes = {}
+    for uploaded_file in uploaded_files or []:
+        if uploaded_file.file_id not in pdf_hashes:
+            pdf_hashes[uploaded_file.file_id] = content_hash(uploaded_file.getvalue())
+        pdf_hash = pdf_hashes[uploaded_file.file_id]
+        # A build that failed in this session keeps showing its error instead of being retried on every rerun
+        pdf_index = st.session_state.get('pdf_indexes', {}).get(pdf_hash)
+        if pdf_index is None:
+            if st.session_state.cohere_api_key != '':
+                # Embeds in the background, the index answers questions with whatever has been embedded so far
+                pdf_index = engine.add_pdf(st.session_state.cohere_api_key, uploaded_file.name, uploaded_file.getvalue(),
+                                           session=session_id)
+            else:
+                st.info("Please add your Cohere API key to continue.")
+                break
+        pdf_indexes[pdf_hash] = pdf_index
 
-    api_key_found = st.session_state.cohere_api_key != ''
+        if pdf_index.error is not None:
+            st.error(f"Error: {str(pdf_index.error)}")
+        elif not pdf_index.finished:
+            st.progress(pdf_index.progress, text=f"Embedding {uploaded_file.name}: {pdf_index.done} chunks")
+    # Removing a file from the uploader also removes it from the chat's references
+    st.session_state['pdf_indexes'] = pdf_indexes
 
-    def extract_text_from_html(html_content):
-        soup = BeautifulSoup(html_content, 'html.parser')
-        text = soup.get_text(separator=' ', strip=True)
-        return text
-    
-    def get_website_index(url):
-        embeddings = CohereEmbeddings(cohere_api_key=st.session_state.cohere_api_key, model="embed-english-v3.0")
-        loader = WebBaseLoader(url)
-        webDocuments = loader.load()
-        for doc in webDocuments:
-            text = extract_text_from_html(doc.page_content)
-            doc.page_content = text
-            index = VectorstoreIndexCreator(embedding=embeddings).from_documents(webDocuments)
-        return index
-    
-    def get_summary(index):
-        llm = Cohere(cohere_api_key=st.session_state.cohere_api_key, model="command-xlarge-nightly")
-        retriever = index.vectorstore.as_retriever()
-        qa = RetrievalQA.from_chain_type(llm, chain_type="stuff", retriever=retriever)
-        summary = qa.run("Summarize the content of the page, and highlight important details of the content.")
-        return summary
-    
-    def prepare_documents(docs):
-        return [{"text": doc.page_content, "metadata": json.dumps(doc.metadata)} for doc in docs]
+    api_key_found = st.session_state.cohere_api_key != ''
 
-    url = st.text_input("Enter a website URL:")
+    urls = [line.strip() for line in st.text_area("Enter website URLs (one per line):").splitlines() if line.strip()]
+    depth = st.number_input("Follow links on the same site (levels)", min_value=0, max_value=2, value=0)
 
     if st.button("Summarize"):
         if not api_key_found: 
             st.info("Please add your Cohere API key to continue.")
         else:
-            if url:
-                if url.startswith("http://") or url.startswith("https://"):
+            if urls:
+                if all(url.startswith("http://") or url.startswith("https://") for url in urls):
                     try:
                         with st.spinner("Summarizing"):
-                            index = get_website_index(url)
+                            index = engine.add_websites(st.session_state.cohere_api_key, urls, depth, session=session_id)
                             st.session_state['website_index'] = index
-                            summary = get_summary(index)
+                            summary = engine.summarize(st.session_state.cohere_api_key, index, session=session_id)
                             st.session_state['summary'] = summary
                             st.success("Website processed successfully!")
                     except Exception as e:
@@ -110,26 +100,16 @@ with st.sidebar:
             else:
                 st.error("Please enter a URL.")
 
+    rerank = st.checkbox("Rerank retrieved passages", help="Slower, but puts the most relevant passages first")
+    stream_responses = st.checkbox("Stream responses", value=True)
+
     if 'summary' in st.session_state:
         st.write("**Summary:**")
         st.write(st.session_state['summary'])
 
     
-    selected_education_background = st.selectbox("Select your educational background", ["Kindergarten","Primary School", "Middle School", "High School", "Bachelor", "Master", "Doctorate"])
-    if selected_education_background == "Kindergarten":
-        preamble = "You are a personalized Study Planning and Tutoring Assistant. You will adapt your communication style, complexity of explanations, and examples based on the user's educational level of kindergarten to ensure optimal understanding and engagement. Your primary role is to follow all instructions from the user, maintaining appropriate educational standards. In analyzing learning materials, you will extract key topics and concepts from uploaded files and links, create a structured outline of the content, and identify prerequisites and learning dependencies. When creating customized study plans, you will break down complex topics into manageable chunks, prioritize topics based on importance and difficulty, and suggest estimated time allocations for each topic. In providing active tutoring, you will answer questions using information primarily from the provided materials. If the information is not provided in the uploaded files and links, you will first apologize, then state 'However, I can answer your question with my own knowledge' before proceeding with an answer based on your own knowledge. You will explain concepts using simple language and examples, generate practice questions and exercises, and provide step-by-step solutions. For progress tracking, you will note which topics have been covered, identify areas needing review, adapt the study plan based on performance, and suggest revision schedules. When responding to queries, you will first confirm which materials you're referencing, state any assumptions about study goals, present information in a structured, easy-to-follow format, use bullet points for clarity, and always ask the user if they need elaboration on any point with more detailed explanation."
-    elif selected_education_background == "Primary School":
-        preamble = "You are a personalized Study Planning and Tutoring Assistant. You will adapt your communication style, complexity of explanations, and examples based on the user's educational level of primary school to ensure optimal understanding and engagement. Your primary role is to follow all instructions from the user, maintaining appropriate educational standards. In analyzing learning materials, you will extract key topics and concepts from uploaded files and links, create a structured outline of the content, and identify prerequisites and learning dependencies. When creating customized study plans, you will break down complex topics into manageable chunks, prioritize topics based on importance and difficulty, and suggest estimated time allocations for each topic. In providing active tutoring, you will answer questions using information primarily from the provided materials. If the information is not provided in the uploaded files and links, you will first apologize, then state 'However, I can answer your question with my own knowledge' before proceeding with an answer based on your own knowledge. You will explain concepts using simple language and examples, generate practice questions and exercises, and provide step-by-step solutions. For progress tracking, you will note which topics have been covered, identify areas needing review, adapt the study plan based on performance, and suggest revision schedules. When responding to queries, you will first confirm which materials you're referencing, state any assumptions about study goals, present information in a structured, easy-to-follow format, use bullet points for clarity, and always ask the user if they need elaboration on any point with more detailed explanation."
-    elif selected_education_background == "Middle School":    
-        preamble = "You are a personalized Study Planning and Tutoring Assistant. You will adapt your communication style, complexity of explanations, and examples based on the user's educational level of middle school to ensure optimal understanding and engagement. Your primary role is to follow all instructions from the user, maintaining appropriate educational standards. In analyzing learning materials, you will extract key topics and concepts from uploaded files and links, create a structured outline of the content, and identify prerequisites and learning dependencies. When creating customized study plans, you will break down complex topics into manageable chunks, prioritize topics based on importance and difficulty, and suggest estimated time allocations for each topic. In providing active tutoring, you will answer questions using information primarily from the provided materials. If the information is not provided in the uploaded files and links, you will first apologize, then state 'However, I can answer your question with my own knowledge' before proceeding with an answer based on your own knowledge. You will explain concepts using simple language and examples, generate practice questions and exercises, and provide step-by-step solutions. For progress tracking, you will note which topics have been covered, identify areas needing review, adapt the study plan based on performance, and suggest revision schedules. When responding to queries, you will first confirm which materials you're referencing, state any assumptions about study goals, present information in a structured, easy-to-follow format, use bullet points for clarity, and always ask the user if they need elaboration on any point with more detailed explanation."
-    elif selected_education_background == "High School":    
-        preamble = "You are a personalized Study Planning and Tutoring Assistant. You will adapt your communication style, complexity of explanations, and examples based on the user's educational level of high school to ensure optimal understanding and engagement. Your primary role is to follow all instructions from the user, maintaining appropriate educational standards. In analyzing learning materials, you will extract key topics and concepts from uploaded files and links, create a structured outline of the content, and identify prerequisites and learning dependencies. When creating customized study plans, you will break down complex topics into manageable chunks, prioritize topics based on importance and difficulty, and suggest estimated time allocations for each topic. In providing active tutoring, you will answer questions using information primarily from the provided materials. If the information is not provided in the uploaded files and links, you will first apologize, then state 'However, I can answer your question with my own knowledge' before proceeding with an answer based on your own knowledge. You will explain concepts using simple language and examples, generate practice questions and exercises, and provide step-by-step solutions. For progress tracking, you will note which topics have been covered, identify areas needing review, adapt the study plan based on performance, and suggest revision schedules. When responding to queries, you will first confirm which materials you're referencing, state any assumptions about study goals, present information in a structured, easy-to-follow format, use bullet points for clarity, and always ask the user if they need elaboration on any point with more detailed explanation."
-    elif selected_education_background == "Bachelor":    
-        preamble = "You are a personalized Study Planning and Tutoring Assistant. You will adapt your communication style, complexity of explanations, and examples based on the user's educational level of bachelor to ensure optimal understanding and engagement. Your primary role is to follow all instructions from the user, maintaining appropriate educational standards. In analyzing learning materials, you will extract key topics and concepts from uploaded files and links, create a structured outline of the content, and identify prerequisites and learning dependencies. When creating customized study plans, you will break down complex topics into manageable chunks, prioritize topics based on importance and difficulty, and suggest estimated time allocations for each topic. In providing active tutoring, you will answer questions using information primarily from the provided materials. If the information is not provided in the uploaded files and links, you will first apologize, then state 'However, I can answer your question with my own knowledge' before proceeding with an answer based on your own knowledge. You will explain concepts using simple language and examples, generate practice questions and exercises, and provide step-by-step solutions. For progress tracking, you will note which topics have been covered, identify areas needing review, adapt the study plan based on performance, and suggest revision schedules. When responding to queries, you will first confirm which materials you're referencing, state any assumptions about study goals, present information in a structured, easy-to-follow format, use bullet points for clarity, and always ask the user if they need elaboration on any point with more detailed explanation."
-    elif selected_education_background == "Master":    
-        preamble = "You are a personalized Study Planning and Tutoring Assistant. You will adapt your communication style, complexity of explanations, and examples based on the user's educational level of master to ensure optimal understanding and engagement. Your primary role is to follow all instructions from the user, maintaining appropriate educational standards. In analyzing learning materials, you will extract key topics and concepts from uploaded files and links, create a structured outline of the content, and identify prerequisites and learning dependencies. When creating customized study plans, you will break down complex topics into manageable chunks, prioritize topics based on importance and difficulty, and suggest estimated time allocations for each topic. In providing active tutoring, you will answer questions using information primarily from the provided materials. If the information is not provided in the uploaded files and links, you will first apologize, then state 'However, I can answer your question with my own knowledge' before proceeding with an answer based on your own knowledge. You will explain concepts using simple language and examples, generate practice questions and exercises, and provide step-by-step solutions. For progress tracking, you will note which topics have been covered, identify areas needing review, adapt the study plan based on performance, and suggest revision schedules. When responding to queries, you will first confirm which materials you're referencing, state any assumptions about study goals, present information in a structured, easy-to-follow format, use bullet points for clarity, and always ask the user if they need elaboration on any point with more detailed explanation."
-    else:
-        preamble = "You are a personalized Study Planning and Tutoring Assistant. You will adapt your communication style, complexity of explanations, and examples based on the user's educational level of doctorate to ensure optimal understanding and engagement. Your primary role is to follow all instructions from the user, maintaining appropriate educational standards. In analyzing learning materials, you will extract key topics and concepts from uploaded files and links, create a structured outline of the content, and identify prerequisites and learning dependencies. When creating customized study plans, you will break down complex topics into manageable chunks, prioritize topics based on importance and difficulty, and suggest estimated time allocations for each topic. In providing active tutoring, you will answer questions using information primarily from the provided materials. If the information is not provided in the uploaded files and links, you will first apologize, then state 'However, I can answer your question with my own knowledge' before proceeding with an answer based on your own knowledge. You will explain concepts using simple language and examples, generate practice questions and exercises, and provide step-by-step solutions. For progress tracking, you will note which topics have been covered, identify areas needing review, adapt the study plan based on performance, and suggest revision schedules. When responding to queries, you will first confirm which materials you're referencing, state any assumptions about study goals, present information in a structured, easy-to-follow format, use bullet points for clarity, and always ask the user if they need elaboration on any point with more detailed explanation."
+    selected_education_background = st.selectbox("Select your educational background", EDUCATION_LEVELS)
+    preamble = preamble_for(selected_education_background)
 
     # st.write(f"Selected document: {selected_doc}")
 
@@ -138,16 +118,17 @@ st.title("AI Tutor")
 
 # Initialize the chat history with a greeting message
 if "messages" not in st.session_state:
-    st.session_state["messages"] = [{"role": "Chatbot", "text": " This is a study helper. Select your educational background first to get the most suitable response from the AI tutor! You can also add PDFs or paste weblinks for the AI's reference. A tip for a more accurate response: when you want it to reference, always say things like 'based on the website/PDF I provided...' first!"}]
+    st.session_state["messages"] = [{"role": "Chatbot", "text": GREETING}]
 
 # Display the chat messages
 for msg in st.session_state.messages:
     st.chat_message(msg["role"]).write(msg["text"])
 
-def get_relevant_docs(index, query, k=3):
-    retriever = index.vectorstore.as_retriever(search_kwargs={'k': k})
-    relevant_docs = retriever.get_relevant_documents(query)
-    return relevant_docs
+def get_source_ids():
+    doc_ids = [index.doc_id for index in st.session_state.get('pdf_indexes', {}).values()]
+    if 'website_index' in st.session_state:
+        doc_ids.append(st.session_state['website_index'].doc_id)
+    return doc_ids
 
 # Get user input
 if prompt := st.chat_input():
@@ -156,35 +137,43 @@ if prompt := st.chat_input():
         st.info("Please add your Cohere API key to continue.")
         st.stop()
 
-    # Create a connection to the Cohere API
-    client = cohere.Client(api_key=st.session_state.cohere_api_key)
     # Display the user message in the chat window
     st.chat_message("User").write(prompt)
 
-    # Collect relevant documents from available indices
-    documents_for_chat = []
-    if 'website_index' in st.session_state:
-        relevant_website_docs = get_relevant_docs(st.session_state['website_index'], prompt)
-        documents_for_chat.extend(prepare_documents(relevant_website_docs))
-    if 'pdf_index' in st.session_state:
-        relevant_pdf_docs = get_relevant_docs(st.session_state['pdf_index'], prompt)
-        documents_for_chat.extend(prepare_documents(relevant_pdf_docs))
-
-    preamble = preamble
-
-    # Send the user message and pdf text to the model and capture the response
-    response = client.chat(chat_history=st.session_state["messages"],
-                           message=prompt,
-                           documents=documents_for_chat,
-                           prompt_truncation='AUTO',
-                           preamble=preamble)
-    
-    # Add the user prompt to the chat history
-    st.session_state.setdefault("messages", []).append({"role": "User", "text": prompt})
-    
-    # Add the response to the chat history
-    msg = response.text
-    st.session_state.messages.append({"role": "Chatbot", "text": msg})
-
-    # Write the response to the chat window
-    st.chat_message("Chatbot").write(msg)
\ No newline at end of file
+    # Retrieve from every source of this session; the engine adds the prompt and the answer to the history
+    history = st.session_state.setdefault("history", ChatHistory())
+    turn = engine.start_turn(st.session_state.cohere_api_key, prompt, st.session_state["messages"], history,
+                             preamble, get_source_ids(), rerank, session=session_id)
+
+    if stream_responses:
+        # Write the response to the chat window as it is generated. Pressing Stop, or anything else
+        # that reruns the app, cancels the stream and keeps the part that was already written.
+        stream = turn.stream()
+        if not turn.cached:
+            st.button("Stop")
+        try:
+            st.chat_message("Chatbot").write_stream(stream)
+        finally:
+            stream.close()
+            st.session_state.setdefault("turn_timings", []).append(turn.timings())
+    else:
+        # Send the user message and the relevant documents to the model and capture the response
+        msg = turn.complete()
+        st.session_state.setdefault("turn_timings", []).append(turn.timings())
+
+        # Write the response to the chat window
+        st.chat_message("Chatbot").write(msg)
+
+# Admin panel with this session's stage timings, drawn last so it includes the turn that just ran
+if show_metrics:
+    with st.sidebar.expander("Session metrics"):
+        report = metrics.session_report(session_id)
+        if report["spans"]:
+            st.dataframe([{key: value for key, value in span.items() if key != "at"} for span in reversed(report["spans"])],
+                         use_container_width=True)
+        st.json(report["counters"])
+
+# Keep refreshing the page while a PDF is still embedding so the progress bars move
+if any(not pdf_index.finished for pdf_index in st.session_state.get('pdf_indexes', {}).values()):
+    time.sleep(0.5)
+    st.rerun()
@@ -3,12 +3,12 @@
 
 import streamlit as st
 import cohere
-import fitz # An alias for the PyMuPDF library.
 
 from langchain.document_loaders import WebBaseLoader
 from langchain.indexes import VectorstoreIndexCreator
 from langchain_cohere.embeddings import CohereEmbeddings
 from bs4 import BeautifulSoup
+from pdf_ingest import iter_pdf_chunks
 
 
 # Check if a valid Cohere API key is found in the .streamlit/secrets.toml file
@@ -37,17 +37,8 @@ with st.sidebar:
     uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
 
     if uploaded_file is not None:
-    # Create a temporary file-like object
-        with fitz.open(stream=uploaded_file.getvalue(), filetype="pdf") as doc:
-            PDFs = []
-            chunk_size = 1000
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                text = page.get_text()
-                part_num = 1
-                for i in range(0, len(text), chunk_size):
-                    PDFs.append({"title": f"Page {page_num + 1} Part {part_num}", "snippet": text[i:i + chunk_size]})
-                    part_num += 1
+    # Chunk the PDF on sentence and paragraph boundaries
+        PDFs = [{"title": chunk["title"], "snippet": chunk["snippet"]} for chunk in iter_pdf_chunks(uploaded_file.getvalue())]
     
 
     api_key_found = st.session_state.cohere_api_key != ''
@@ -0,0 +1,6 @@
+# Lets pytest import the modules at the repo root when run as plain `pytest`
+import os
+import tempfile
+
+# Modules read the cache directory on import, keep the tests away from the app's own .cache
+os.environ.setdefault("CHATBOT_CACHE_DIR", tempfile.mkdtemp(prefix="chatbot-tests-"))
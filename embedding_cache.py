@@ -0,0 +1,168 @@
+# Disk-backed caches so an unchanged PDF is parsed and embedded only once
+# Embeddings are keyed by a hash of (model, chunk text), indexes by a hash of the uploaded file's bytes
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import metrics
+from pdf_ingest import count_tokens
+
+
+CACHE_DIR = os.environ.get("CHATBOT_CACHE_DIR", ".cache")
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def embedding_key(model, text):
+    return content_hash(f"{model}\0{text}")
+
+
+class EmbeddingCache:
+    # Stores one float32 vector per (model, text) key in SQLite and evicts the least recently used
+    # entries once either max_entries or max_bytes is exceeded. The entry count and total size are kept
+    # in a meta row, so checking the limits never scans the table.
+    def __init__(self, path=None, max_entries=200_000, max_bytes=1024 * 1024 * 1024):
+        self.path = path or os.path.join(CACHE_DIR, "embeddings.sqlite3")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Caches written before vectors were stored as float32 blobs are simply dropped
+        self._conn.execute("DROP TABLE IF EXISTS embeddings")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                           "count INTEGER NOT NULL, size INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO totals "
+                           "SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM vectors")
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        found = {}
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look keys up in slices
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM vectors WHERE key IN ({placeholders})", part
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32).tolist()) for key, vector in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE vectors SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+        return [found.get(key) for key in keys]
+
+    def put_many(self, keys, vectors):
+        if not keys:
+            return
+        now = time.time()
+        rows = {}
+        for key, vector in zip(keys, vectors):
+            encoded = np.asarray(vector, dtype=np.float32).tobytes()
+            rows[key] = (key, encoded, len(encoded), now)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Replaced entries are taken off the totals before the new ones are added
+                replaced = []
+                part_keys = list(rows)
+                for i in range(0, len(part_keys), 500):
+                    part = part_keys[i:i + 500]
+                    placeholders = ",".join("?" * len(part))
+                    replaced += self._conn.execute(f"SELECT size FROM vectors WHERE key IN ({placeholders})", part).fetchall()
+                self._conn.executemany("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)", rows.values())
+                added = len(rows) - len(replaced)
+                size = sum(row[2] for row in rows.values()) - sum(entry_size for entry_size, in replaced)
+                self._conn.execute("UPDATE totals SET count = count + ?, size = size + ? WHERE id = 0", (added, size))
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self):
+        count, size = self._conn.execute("SELECT count, size FROM totals WHERE id = 0").fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+        # Drop the oldest entries in one pass until both limits are satisfied again
+        doomed = []
+        for key, entry_size in self._conn.execute("SELECT key, size FROM vectors ORDER BY last_used"):
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            size -= entry_size
+        self._conn.executemany("DELETE FROM vectors WHERE key = ?", doomed)
+        self._conn.execute("UPDATE totals SET count = ?, size = ? WHERE id = 0", (count, size))
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps any LangChain embeddings object and only sends texts that are not cached yet.
+    # Queries are not cached: Cohere v3 embeds queries and documents differently and queries rarely repeat.
+    def __init__(self, embeddings, cache, model, session=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+        self.session = session
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(self.model, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        metrics.count("tutor_cache_total", len(texts) - len(missing), self.session, cache="embedding", result="hit")
+        metrics.count("tutor_cache_total", len(missing), self.session, cache="embedding", result="miss")
+        if missing:
+            # The same chunk can appear more than once in a document, embed each distinct text once
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            with metrics.span("embed", self.session, texts=len(unique)):
+                fresh = dict(zip(unique, self.embeddings.embed_documents(unique)))
+            if metrics.ENABLED:
+                metrics.count("tutor_tokens_total", sum(count_tokens(text) for text in unique), self.session, kind="embedded")
+            self.cache.put_many([embedding_key(self.model, text) for text in unique], [fresh[text] for text in unique])
+            for i in missing:
+                vectors[i] = fresh[texts[i]]
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+class IndexCache:
+    # Keeps built indexes keyed by the upload's content hash, so reruns and other sessions that
+    # upload the same file reuse them. Evicts the least recently used index beyond max_items.
+    def __init__(self, max_items=32):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
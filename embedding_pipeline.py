@@ -0,0 +1,215 @@
+# Batched, concurrent embedding of document chunks into a vector store
+# Batches run on a shared thread pool, back off together on rate limits and land in the store one by one,
+# so a partially built index can already answer questions while the rest is still embedding
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.vectorstores import InMemoryVectorStore
+
+import metrics
+
+
+# Cohere's embed endpoint accepts at most 96 texts per call
+BATCH_SIZE = 96
+MAX_WORKERS = 4
+MAX_RETRIES = 5
+BASE_DELAY = 1.0
+# How often a build waiting on another process's build of the same document checks on it
+POLL_INTERVAL = 1.0
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="embed")
+
+
+def is_rate_limited(error):
+    return getattr(error, "status_code", None) == 429
+
+
+class RateLimitGate:
+    # Shared by all batches: once any call is rate limited, every worker waits out the same cooldown
+    def __init__(self, base_delay=BASE_DELAY, session=None):
+        self.base_delay = base_delay
+        self.session = session
+        self.retries = 0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, attempt):
+        with self._lock:
+            self.retries += 1
+            delay = self.base_delay * 2 ** attempt + random.uniform(0, self.base_delay)
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        metrics.count("tutor_api_retries_total", 1, self.session, api="embed")
+
+
+def call_with_retries(fn, *args, gate=None, max_retries=MAX_RETRIES):
+    gate = gate or RateLimitGate()
+    for attempt in range(max_retries + 1):
+        gate.wait()
+        try:
+            return fn(*args)
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == max_retries:
+                raise
+            gate.backoff(attempt)
+
+
+class IndexBuild:
+    # Exposes .vectorstore like LangChain's VectorstoreIndexWrapper, so it can be queried while building
+    def __init__(self, vectorstore, doc_id=None, on_complete=None, session=None, base_delay=BASE_DELAY):
+        self.vectorstore = vectorstore
+        self.doc_id = doc_id
+        self.on_complete = on_complete
+        self.session = session
+        self.total = 0
+        self.done = 0
+        self.error = None
+        self.gate = RateLimitGate(base_delay, session=session)
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self._callbacks = []
+        self._finished = threading.Event()
+        # The producer holds one pending slot until it has handed out every batch
+        self._pending = 1
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self._finished.is_set()
+
+    @property
+    def progress(self):
+        return self.done / self.total if self.total else 0.0
+
+    def add_done_callback(self, fn):
+        # fn(build) runs once the build has finished or failed, right away if it already has
+        with self._lock:
+            if not self._finished.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def wait(self, timeout=None):
+        self._finished.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def _batch_added(self, size):
+        with self._lock:
+            self._pending += 1
+            self.total += size
+
+    def _batch_done(self, size, error=None):
+        with self._lock:
+            self._pending -= 1
+            if error is not None:
+                self.error = self.error or error
+            else:
+                self.done += size
+            if self._pending != 0:
+                return
+            if self.error is None and self.on_complete is not None:
+                try:
+                    self.on_complete()
+                except Exception as e:
+                    self.error = e
+            self.elapsed = time.perf_counter() - self.started
+            self._finished.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_index(documents, embeddings, store=None, doc_id=None, batch_size=BATCH_SIZE, executor=None, max_retries=MAX_RETRIES,
+                session=None, on_complete=None, base_delay=BASE_DELAY):
+    # documents may be a lazy iterable: it is consumed on a background thread with only a few
+    # batches in flight at a time, so huge uploads never sit in memory as one list.
+    # With a persistent store the index is scoped to doc_id, and a document that was fully
+    # indexed before (by any session, or before a restart) is reused without reading documents at all.
+    # on_complete runs on the build's thread once every chunk is stored, before the build counts as finished.
+    if store is None:
+        build = IndexBuild(InMemoryVectorStore(embedding=embeddings), on_complete=on_complete, session=session,
+                           base_delay=base_delay)
+    else:
+        if store.storage.is_complete(doc_id):
+            build = IndexBuild(store.scoped([doc_id], embedding=embeddings), doc_id, session=session)
+            build._batch_done(0)
+            return build
+        # Another session or worker may be building the same document, only the one holding the claim writes
+        owner = uuid.uuid4().hex
+
+        def complete():
+            store.storage.mark_complete(doc_id, owner)
+            if on_complete is not None:
+                on_complete()
+
+        build = IndexBuild(store.scoped([doc_id], embedding=embeddings, owner=owner), doc_id,
+                           on_complete=complete, session=session, base_delay=base_delay)
+        build.add_done_callback(lambda build: build.error is not None and store.storage.release(doc_id, owner))
+    in_flight = threading.BoundedSemaphore(MAX_WORKERS * 2)
+
+    def run(batch):
+        try:
+            # Skip the remaining batches once one has failed for good
+            if build.error is not None:
+                build._batch_done(len(batch), build.error)
+                return
+            try:
+                call_with_retries(build.vectorstore.add_documents, batch, gate=build.gate, max_retries=max_retries)
+            except Exception as e:
+                build._batch_done(len(batch), e)
+            else:
+                build._batch_done(len(batch))
+        finally:
+            in_flight.release()
+
+    def claim():
+        # Waits while another live builder owns the document; True once this build should write it
+        while True:
+            state = store.storage.claim(doc_id, owner)
+            if state != "building":
+                return state == "claimed"
+            time.sleep(POLL_INTERVAL)
+
+    def produce():
+        try:
+            if store is not None and not claim():
+                # Finished by the other builder, documents are never read
+                build.on_complete = on_complete
+                build._batch_done(0)
+                return
+            for batch in iter_batches(documents, batch_size):
+                if build.error is not None:
+                    break
+                in_flight.acquire()
+                if store is not None:
+                    # Slow extraction or a long rate limit wait must not make the claim look abandoned
+                    store.storage.heartbeat(doc_id, owner)
+                build._batch_added(len(batch))
+                (executor or _executor).submit(run, batch)
+        except Exception as e:
+            build._batch_done(0, e)
+        else:
+            build._batch_done(0)
+
+    threading.Thread(target=produce, name="embed-producer", daemon=True).start()
+    return build
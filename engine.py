@@ -0,0 +1,288 @@
+# The tutor's ingestion, retrieval and chat pipeline without any UI, shared by the Streamlit app and the HTTP API
+# One TutorEngine per process holds every cache, the vector store and a pooled connection for all Cohere clients
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import cohere
+import httpx
+from langchain.chains import RetrievalQA
+from langchain.llms import Cohere
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+
+import metrics
+from chat import ChatTurn
+from embedding_cache import EmbeddingCache, CachedEmbeddings, IndexCache, content_hash
+from embedding_pipeline import build_index
+from history import llm_summarizer
+from pdf_ingest import chunk_pages, count_tokens, iter_pages
+from response_cache import ResponseCache
+from retrieval import BM25Index, CohereReranker, UnifiedRetriever
+from vector_store import VectorStorage, LocalVectorStore
+from web_ingest import PageCache, load_websites, make_session
+
+
+EMBED_MODEL = "embed-english-v3.0"
+SUMMARY_MODEL = "command-xlarge-nightly"
+# API keys whose clients are kept, the least recently used key's client is dropped beyond this
+MAX_CLIENTS = 256
+SUMMARY_QUESTION = "Summarize the content of the page, and highlight important details of the content."
+
+EDUCATION_LEVELS = ["Kindergarten", "Primary School", "Middle School", "High School", "Bachelor", "Master", "Doctorate"]
+PREAMBLE = "You are a personalized Study Planning and Tutoring Assistant. You will adapt your communication style, complexity of explanations, and examples based on the user's educational level of {level} to ensure optimal understanding and engagement. Your primary role is to follow all instructions from the user, maintaining appropriate educational standards. In analyzing learning materials, you will extract key topics and concepts from uploaded files and links, create a structured outline of the content, and identify prerequisites and learning dependencies. When creating customized study plans, you will break down complex topics into manageable chunks, prioritize topics based on importance and difficulty, and suggest estimated time allocations for each topic. In providing active tutoring, you will answer questions using information primarily from the provided materials. If the information is not provided in the uploaded files and links, you will first apologize, then state 'However, I can answer your question with my own knowledge' before proceeding with an answer based on your own knowledge. You will explain concepts using simple language and examples, generate practice questions and exercises, and provide step-by-step solutions. For progress tracking, you will note which topics have been covered, identify areas needing review, adapt the study plan based on performance, and suggest revision schedules. When responding to queries, you will first confirm which materials you're referencing, state any assumptions about study goals, present information in a structured, easy-to-follow format, use bullet points for clarity, and always ask the user if they need elaboration on any point with more detailed explanation."
+
+GREETING = " This is a study helper. Select your educational background first to get the most suitable response from the AI tutor! You can also add PDFs or paste weblinks for the AI's reference. A tip for a more accurate response: when you want it to reference, always say things like 'based on the website/PDF I provided...' first!"
+
+
+def preamble_for(level):
+    return PREAMBLE.format(level=level.lower())
+
+
+def prepare_documents(docs):
+    return [{"text": doc.page_content, "metadata": json.dumps(doc.metadata)} for doc in docs]
+
+
+def prompt_tokens(chat_kwargs):
+    # Roughly what one chat call sends: preamble, verbatim history, retrieved passages and the message
+    texts = [chat_kwargs["preamble"], chat_kwargs["message"]]
+    texts += [message["text"] for message in chat_kwargs["chat_history"]]
+    texts += [document["text"] for document in chat_kwargs["documents"]]
+    return sum(count_tokens(text) for text in texts)
+
+
+def record_build(session, pages=None, chunks=None):
+    # Called when an index build finishes. Extraction and chunking run lazily inside the build's producer,
+    # so their time is what the wrapped iterators spent producing items, chunking excluding extraction.
+    def record(build):
+        if pages is not None and pages.count:
+            metrics.observe("extract", pages.elapsed, session, pages=pages.count)
+        if chunks is not None and chunks.count:
+            extract = pages.elapsed if pages is not None else 0.0
+            metrics.observe("chunk", max(0.0, chunks.elapsed - extract), session, chunks=chunks.count)
+        if build.done or build.error is not None:
+            metrics.observe("index", build.elapsed, session, chunks=build.done, failed=build.error is not None)
+    return record
+
+
+class CohereEmbedder(Embeddings):
+    # One embed request per call on a shared cohere.Client. Both LangChain's tenacity retries and the SDK's
+    # own retries on 429/5xx are off, so rate limits reach call_with_retries and the build's shared RateLimitGate.
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+
+    def _embed(self, texts, input_type):
+        response = self.client.embed(model=self.model, texts=texts, input_type=input_type, embedding_types=["float"],
+                                     request_options={"max_retries": 0})
+        return [[float(value) for value in vector] for vector in response.embeddings.float_]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, "search_document")
+
+    def embed_query(self, text):
+        return self._embed([text], "search_query")[0]
+
+
+class TutorEngine:
+    def __init__(self, max_connections=64, max_clients=MAX_CLIENTS):
+        self.embedding_cache = EmbeddingCache()
+        self.index_cache = IndexCache()
+        self.vector_store = LocalVectorStore(VectorStorage())
+        self.bm25 = BM25Index()
+        self.response_cache = ResponseCache()
+        self.page_cache = PageCache()
+        self.http_session = make_session()
+        # Every cohere.Client shares this connection pool, whichever API key it uses
+        self._httpx = httpx.Client(limits=httpx.Limits(max_connections=max_connections), timeout=300)
+        # api_key -> (cohere.Client, CohereEmbedder), least recently used first
+        self._clients = OrderedDict()
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+
+    def _client_pair(self, api_key):
+        with self._lock:
+            if api_key not in self._clients:
+                client = cohere.Client(api_key=api_key, httpx_client=self._httpx)
+                self._clients[api_key] = (client, CohereEmbedder(client, EMBED_MODEL))
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+            self._clients.move_to_end(api_key)
+            return self._clients[api_key]
+
+    def client(self, api_key):
+        return self._client_pair(api_key)[0]
+
+    def embeddings(self, api_key, session=None):
+        # The embedder is kept per key, only the cache wrapper carrying the session is made per call
+        return CachedEmbeddings(self._client_pair(api_key)[1], self.embedding_cache, EMBED_MODEL, session)
+
+    def add_pdf(self, api_key, name, data, session=None):
+        # Returns the index build right away, the PDF is extracted and embedded in the background
+        with metrics.span("upload", session, bytes=len(data)):
+            pdf_hash = content_hash(data)
+            pdf_index = self.index_cache.get(pdf_hash)
+            if pdf_index is None or pdf_index.error is not None:
+                pages = metrics.TimedIter(iter_pages(data))
+                chunks = metrics.TimedIter(chunk_pages(pages))
+                documents = (Document(page_content=pdf['snippet'], metadata={'title': f"{name} {pdf['title']}", 'page': pdf['page'], 'offset': pdf['offset']})
+                             for pdf in chunks)
+                pdf_index = build_index(documents, self.embeddings(api_key, session), store=self.vector_store,
+                                        doc_id=pdf_hash, session=session, on_complete=self._lexical_indexer(pdf_hash))
+                pdf_index.add_done_callback(record_build(session, pages, chunks))
+                self.index_cache.put(pdf_hash, pdf_index)
+        return pdf_index
+
+    def add_websites(self, api_key, urls, depth=0, session=None):
+        # Unchanged pages give the same doc_id, so they are not embedded again.
+        # A summary needs the whole site, so this waits for every batch.
+        with metrics.span("crawl", session, urls=len(urls)) as fields:
+            documents = load_websites(urls, depth, session=self.http_session, cache=self.page_cache)
+            if metrics.ENABLED:
+                fields["chunks"] = len(documents)
+        doc_id = content_hash("\n".join(doc.page_content for doc in documents))
+        web_index = build_index(documents, self.embeddings(api_key, session), store=self.vector_store,
+                                doc_id=doc_id, session=session, on_complete=self._lexical_indexer(doc_id))
+        web_index.add_done_callback(record_build(session))
+        web_index.wait()
+        self.index_cache.put(doc_id, web_index)
+        return web_index
+
+    def _lexical_indexer(self, doc_id):
+        # BM25 entries are built on the build's thread as soon as it completes, not by the first question
+        return lambda: self.bm25.add(doc_id, self.vector_store.storage.chunks(doc_id))
+
+    def source_status(self, doc_id):
+        # Builds run in the worker that started them, other workers only see the shared store
+        source_index = self.index_cache.get(doc_id)
+        if source_index is None:
+            return {"source_id": doc_id, "finished": self.vector_store.storage.is_complete(doc_id),
+                    "chunks": None, "error": None, "known": self.vector_store.storage.is_complete(doc_id)}
+        return {"source_id": doc_id, "finished": source_index.finished, "chunks": source_index.done,
+                "error": str(source_index.error) if source_index.error is not None else None, "known": True}
+
+    def sources_ready(self, doc_ids):
+        return all(self.vector_store.storage.is_complete(doc_id) for doc_id in doc_ids)
+
+    def summarize(self, api_key, source_index, session=None):
+        summary = self.response_cache.get(source_index.doc_id, "", SUMMARY_QUESTION)
+        metrics.count("tutor_cache_total", 1, session, cache="summary", result="miss" if summary is None else "hit")
+        if summary is None:
+            with metrics.span("summarize", session):
+                llm = Cohere(cohere_api_key=api_key, model=SUMMARY_MODEL)
+                retriever = source_index.vectorstore.as_retriever()
+                qa = RetrievalQA.from_chain_type(llm, chain_type="stuff", retriever=retriever)
+                summary = qa.run(SUMMARY_QUESTION)
+            self.response_cache.put(source_index.doc_id, "", SUMMARY_QUESTION, summary)
+        return summary
+
+    def retrieve(self, api_key, query, doc_ids, rerank=False, query_vector=None, session=None, exclude=()):
+        # One search over every given source, queries embedded with the caller's key
+        with metrics.span("retrieve", session, sources=len(doc_ids), rerank=rerank) as fields:
+            retriever = UnifiedRetriever(self.vector_store.scoped(None, self.embeddings(api_key, session)), self.bm25,
+                                         reranker=CohereReranker(self.client(api_key)) if rerank else None)
+            docs = retriever.retrieve(query, doc_ids, query_vector, exclude)
+            if metrics.ENABLED:
+                fields["documents"] = len(docs)
+        return docs
+
+    def start_turn(self, api_key, prompt, messages, history, preamble, doc_ids, rerank=False, session=None):
+        # messages and history belong to the caller and are updated once the turn has an answer
+        client = self.client(api_key)
+        doc_ids = list(doc_ids)
+
+        # Opening questions do not depend on earlier turns, so they can be answered from the shared cache.
+        # The query vector is reused for retrieval on a miss, the cache costs no extra embedding call.
+        # Answers given while a source is still embedding saw only part of it and are not cached.
+        source_key = content_hash("\n".join(sorted(doc_ids)))
+        cacheable = not any(msg["role"] == "User" for msg in messages) and self.sources_ready(doc_ids)
+        query_vector = None
+        if doc_ids:
+            with metrics.span("embed_query", session):
+                query_vector = self.embeddings(api_key, session).embed_query(prompt)
+        cached_answer = self.response_cache.get(source_key, preamble, prompt, query_vector) if cacheable else None
+        if cacheable:
+            metrics.count("tutor_cache_total", 1, session, cache="response", result="miss" if cached_answer is None else "hit")
+
+        # Send recent turns verbatim and fold older ones into a summary, so each turn costs about the same
+        chat_history, summary = history.prepare(messages, llm_summarizer(client))
+        full_preamble = f"{preamble}\n\nSummary of the earlier conversation: {summary}" if summary else preamble
+
+        # Collect relevant documents from all sources, minus those already sent with a recent turn
+        documents = []
+        if cached_answer is None:
+            documents = prepare_documents(self.retrieve(api_key, prompt, doc_ids, rerank, query_vector, session,
+                                                        exclude=history.sent_keys()))
+
+        chat_kwargs = dict(chat_history=chat_history,
+                           message=prompt,
+                           documents=documents,
+                           prompt_truncation='AUTO',
+                           preamble=full_preamble)
+        return TutorTurn(self, client, prompt, messages, history, chat_kwargs, cached_answer,
+                         (source_key, preamble, prompt, query_vector) if cacheable else None, session)
+
+
+class TutorTurn:
+    def __init__(self, engine, client, prompt, messages, history, chat_kwargs, cached_answer, cache_key, session=None):
+        self.engine = engine
+        self.client = client
+        self.prompt = prompt
+        self.messages = messages
+        self.history = history
+        self.chat_kwargs = chat_kwargs
+        self.cached_answer = cached_answer
+        self.cache_key = cache_key
+        self.session = session
+        self.user_index = len(messages)
+        self.chat = ChatTurn()
+
+    @property
+    def cached(self):
+        return self.cached_answer is not None
+
+    def stream(self):
+        # A generator of text pieces. Closing it early cancels the turn and keeps the part already generated.
+        if self.cached:
+            self._finish(self.cached_answer)
+            yield self.cached_answer
+            return
+        # A stream that failed part way is neither cached nor added to the conversation
+        try:
+            yield from self.chat.stream(self.client, **self.chat_kwargs)
+        finally:
+            if self.chat.text and self.chat.error is None:
+                self._finish(self.chat.text, self.chat.cancelled, self.chat.completed)
+
+    def complete(self):
+        if self.cached:
+            self._finish(self.cached_answer)
+            return self.cached_answer
+        self.chat.started = time.perf_counter()
+        response = self.client.chat(**self.chat_kwargs)
+        self.chat.first_token_at = self.chat.finished_at = time.perf_counter()
+        self.chat.text = response.text
+        self._finish(response.text)
+        return response.text
+
+    def _finish(self, text, cancelled=False, completed=True):
+        if self.cache_key is not None and completed and not cancelled and not self.cached:
+            self.engine.response_cache.put(*self.cache_key[:3], text, self.cache_key[3])
+        self.history.record_documents(self.user_index, self.chat_kwargs["documents"])
+        self.messages.append({"role": "User", "text": self.prompt})
+        self.messages.append({"role": "Chatbot", "text": text})
+        if metrics.ENABLED and not self.cached:
+            timings = self.chat.timings()
+            sent, received = prompt_tokens(self.chat_kwargs), count_tokens(text)
+            metrics.observe("chat", timings["total_time"], self.session, cancelled=cancelled,
+                            prompt_tokens=sent, completion_tokens=received)
+            metrics.count("tutor_tokens_total", sent, self.session, kind="prompt")
+            metrics.count("tutor_tokens_total", received, self.session, kind="completion")
+            if timings["time_to_first_token"] is not None:
+                metrics.time_to_first_token(timings["time_to_first_token"], self.session)
+
+    def timings(self):
+        if self.cached:
+            return {"time_to_first_token": 0.0, "total_time": 0.0, "cancelled": False, "cached": True}
+        return dict(self.chat.timings(), cached=False)
@@ -0,0 +1,88 @@
+# Local stand-ins for the Cohere endpoints, for trying the pipeline without an API key or network
+# Vectors are deterministic bag-of-words hashes, so texts that share words land close together
+import hashlib
+import math
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from langchain_core.embeddings import Embeddings
+
+
+class RateLimitError(Exception):
+    # Mirrors the status_code attribute of cohere's ApiError so retry logic treats both the same way
+    status_code = 429
+
+
+def fake_vector(text, dim):
+    vector = [0.0] * dim
+    for word in re.findall(r"\w+", text.lower()):
+        bucket = int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:4], "little")
+        vector[bucket % dim] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class FakeEmbeddings(Embeddings):
+    # latency is the simulated round trip per call, max_calls_per_second raises RateLimitError when exceeded
+    def __init__(self, dim=256, latency=0.05, max_calls_per_second=None):
+        self.dim = dim
+        self.latency = latency
+        self.max_calls_per_second = max_calls_per_second
+        self.calls = 0
+        self.rate_limited = 0
+        self._recent = []
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+            if self.max_calls_per_second is not None:
+                now = time.monotonic()
+                self._recent = [t for t in self._recent if now - t < 1.0]
+                if len(self._recent) >= self.max_calls_per_second:
+                    self.rate_limited += 1
+                    raise RateLimitError("Too many requests")
+                self._recent.append(now)
+        time.sleep(self.latency)
+
+    def embed_documents(self, texts):
+        self._call()
+        return [fake_vector(text, self.dim) for text in texts]
+
+    def embed_query(self, text):
+        self._call()
+        return fake_vector(text, self.dim)
+
+
+class FakeChatClient:
+    # Answers every message with a fixed sentence, streamed word by word.
+    # first_token_latency and token_latency shape the stream, latency is the round trip of a non-streaming chat.
+    def __init__(self, first_token_latency=0.3, token_latency=0.02, latency=1.0, answer_words=60):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.latency = latency
+        self.answer_words = answer_words
+        self.calls = 0
+
+    def answer(self, message, documents=None):
+        words = f"Based on {len(documents or [])} documents, here is an answer to: {message}".split()
+        filler = ["study"] * max(self.answer_words - len(words), 0)
+        return " ".join(words + filler)
+
+    def chat(self, message, documents=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return SimpleNamespace(text=self.answer(message, documents))
+
+    def chat_stream(self, message, documents=None, **kwargs):
+        self.calls += 1
+        text = self.answer(message, documents)
+        yield SimpleNamespace(event_type="stream-start")
+        time.sleep(self.first_token_latency)
+        for i, word in enumerate(text.split(" ")):
+            if i:
+                time.sleep(self.token_latency)
+            yield SimpleNamespace(event_type="text-generation", text=word if i == 0 else " " + word)
+        yield SimpleNamespace(event_type="stream-end", response=SimpleNamespace(text=text))
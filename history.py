@@ -0,0 +1,96 @@
+# Keeps the chat history sent to the model within a token budget: recent turns go verbatim, older ones
+# are folded into a running summary, and passages already sent with a visible turn are not sent again
+import hashlib
+
+from pdf_ingest import count_tokens
+
+
+HISTORY_TOKENS = 1500
+SUMMARY_WORDS = 200
+
+
+def message_tokens(message):
+    return count_tokens(message["text"])
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_key(document):
+    return text_key(document["text"])
+
+
+def transcript(messages):
+    return "\n".join(f"{message['role']}: {message['text']}" for message in messages)
+
+
+def extractive_summary(summary, messages, max_words=SUMMARY_WORDS):
+    # Used when no model is available: the first sentence of every folded message, newest kept last
+    firsts = [f"{message['role']}: {message['text'].split('. ')[0].strip()}" for message in messages]
+    words = " ".join(filter(None, [summary] + firsts)).split()
+    return " ".join(words[-max_words:])
+
+
+def llm_summarizer(client):
+    def summarize(summary, messages):
+        prompt = (f"Update the summary of a tutoring conversation with the new messages below. "
+                  f"Keep the student's goals, level, topics covered and open questions. "
+                  f"Answer with the summary only, in under {SUMMARY_WORDS} words.\n\n"
+                  f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript(messages)}")
+        return client.chat(message=prompt).text.strip()
+    return summarize
+
+
+class ChatHistory:
+    # messages is the full transcript shown in the UI, the first skip messages (the greeting) are never sent
+    def __init__(self, token_budget=HISTORY_TOKENS, skip=1):
+        self.token_budget = token_budget
+        self.skip = skip
+        self.summary = ""
+        self.folded = skip
+        self.sent_documents = {}
+
+    def _window_start(self, messages, budget):
+        start = len(messages)
+        used = 0
+        while start > self.folded and used + message_tokens(messages[start - 1]) <= budget:
+            start -= 1
+            used += message_tokens(messages[start])
+        # Never start the verbatim part with half a turn
+        while start < len(messages) and messages[start]["role"] != "User":
+            start += 1
+        return start
+
+    def prepare(self, messages, summarize=extractive_summary):
+        # Returns (chat_history, summary) for the next turn, folding old turns into the summary when the
+        # verbatim part outgrows the budget. Folding goes down to half the budget, so it only happens
+        # every few turns and the summary is updated incrementally, never rebuilt from the whole transcript.
+        if self._window_start(messages, self.token_budget) > self.folded:
+            # The latest exchange always stays verbatim, however long, so follow-ups can refer to it
+            last_user = max((i for i in range(self.folded, len(messages)) if messages[i]["role"] == "User"),
+                            default=self.folded)
+            start = min(self._window_start(messages, self.token_budget // 2), last_user)
+            if start > self.folded:
+                folding = messages[self.folded:start]
+                try:
+                    self.summary = summarize(self.summary, folding)
+                except Exception:
+                    self.summary = extractive_summary(self.summary, folding)
+                self.folded = start
+                self.sent_documents = {index: keys for index, keys in self.sent_documents.items() if index >= start}
+        return messages[self.folded:], self.summary
+
+    def to_dict(self):
+        # Plain JSON, so stateless API workers can hand the history state back to the client between turns.
+        # The token budget and skip are the server's and are not part of it, see api.load_history.
+        return {"summary": self.summary, "folded": self.folded,
+                "sent_documents": {str(index): sorted(keys) for index, keys in self.sent_documents.items()}}
+
+    def sent_keys(self):
+        # text_key of every passage sent with a turn that is still part of the verbatim history. Retrieval
+        # skips these before filling its token budget, so a follow-up gets new passages instead of fewer.
+        return set().union(*self.sent_documents.values()) if self.sent_documents else set()
+
+    def record_documents(self, message_index, documents):
+        self.sent_documents[message_index] = {document_key(document) for document in documents}
@@ -0,0 +1,180 @@
+# Per-stage tracing for upload -> extract -> chunk -> embed -> index -> retrieve -> chat
+# Durations, token and chunk counts, cache hits and API retries are kept per session and process wide,
+# exported as Prometheus text and as one JSON log line per event. Turned off unless CHATBOT_METRICS=1
+# or enable() is called; when off, every hook returns immediately.
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager, nullcontext
+
+
+ENABLED = os.environ.get("CHATBOT_METRICS", "") not in ("", "0")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MAX_SESSIONS = 1000
+SPANS_PER_SESSION = 200
+
+logger = logging.getLogger("tutor.metrics")
+
+_lock = threading.Lock()
+# (name, sorted label items) -> value
+_counters = defaultdict(float)
+# (name, sorted label items) -> [bucket counts..., sum, count]
+_histograms = {}
+_sessions = OrderedDict()
+_NOOP = nullcontext()
+
+
+def _log_to_stderr():
+    # One JSON object per line on stderr, unless the application has set up its own handlers
+    if not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+    if enabled:
+        _log_to_stderr()
+
+
+if ENABLED:
+    _log_to_stderr()
+
+
+def reset():
+    # Forgets every recorded number, for tests and for long-running processes that scrape and restart counting
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _sessions.clear()
+
+
+def _session(session):
+    # Called with _lock held
+    if session not in _sessions:
+        _sessions[session] = {"spans": deque(maxlen=SPANS_PER_SESSION), "counters": defaultdict(float)}
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    _sessions.move_to_end(session)
+    return _sessions[session]
+
+
+def _observe(name, seconds, labels):
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram[i] += 1
+    histogram[-2] += seconds
+    histogram[-1] += 1
+
+
+def observe(stage, seconds, session=None, **fields):
+    # Records one finished stage; fields are extra numbers worth logging, such as chunk or token counts
+    if not ENABLED:
+        return
+    with _lock:
+        _observe("tutor_stage_seconds", seconds, {"stage": stage})
+        if session is not None:
+            _session(session)["spans"].append({"stage": stage, "seconds": seconds, "at": time.time(), **fields})
+    logger.info(json.dumps({"event": "stage", "stage": stage, "seconds": round(seconds, 6), "session": session, **fields}))
+
+
+def count(name, value=1, session=None, **labels):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[(name, tuple(sorted(labels.items())))] += value
+        if session is not None:
+            label = ",".join(f"{key}={labels[key]}" for key in sorted(labels))
+            _session(session)["counters"][f"{name}{{{label}}}" if label else name] += value
+    logger.info(json.dumps({"event": "count", "name": name, "value": value, "session": session, **labels}))
+
+
+def time_to_first_token(seconds, session=None):
+    if not ENABLED:
+        return
+    with _lock:
+        _observe("tutor_time_to_first_token_seconds", seconds, {})
+    logger.info(json.dumps({"event": "time_to_first_token", "seconds": round(seconds, 6), "session": session}))
+
+
+@contextmanager
+def _span(stage, session, fields):
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        observe(stage, time.perf_counter() - started, session, **fields)
+
+
+def span(stage, session=None, **fields):
+    # with span("retrieve", session) as fields: ... fields["documents"] = 3
+    if not ENABLED:
+        return _NOOP
+    return _span(stage, session, dict(fields))
+
+
+class TimedIter:
+    # Wraps a generator and adds up the time spent producing its items, for stages that stream
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.elapsed = 0.0
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            item = next(self._iterator)
+        finally:
+            self.elapsed += time.perf_counter() - started
+        self.count += 1
+        return item
+
+
+def session_report(session):
+    with _lock:
+        data = _sessions.get(session)
+        if data is None:
+            return {"spans": [], "counters": {}}
+        return {"spans": list(data["spans"]), "counters": dict(data["counters"])}
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        for name in sorted({name for name, _ in _counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (counter, labels), value in sorted(_counters.items()):
+                if counter == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in _histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (histogram, labels), values in sorted(_histograms.items()):
+                if histogram != name:
+                    continue
+                for bound, bucket in zip(BUCKETS, values):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,220 @@
+# Streaming PDF ingestion: pages come out of PyMuPDF one at a time and are chunked on
+# heading, paragraph and sentence boundaries with a token budget and overlap
+import contextlib
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+
+import fitz # An alias for the PyMuPDF library.
+
+
+CHUNK_TOKENS = 256
+OVERLAP_TOKENS = 48
+
+# Documents with fewer pages than this are extracted on the calling thread
+PARALLEL_MIN_PAGES = 100
+PAGES_PER_SHARD = 16
+EXTRACT_WORKERS = min(4, os.cpu_count() or 1)
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+
+
+def count_tokens(text):
+    # Words and punctuation marks, a close enough stand-in for the embedding model's tokenizer
+    return len(_TOKEN_RE.findall(text))
+
+
+def page_text(page):
+    # Text blocks in reading order, separated by blank lines so paragraph boundaries survive
+    blocks = page.get_text("blocks", sort=True)
+    return "\n\n".join(block[4].strip() for block in blocks if block[6] == 0 and block[4].strip())
+
+
+def iter_pages_serial(pdf_bytes, start=0):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for page_num in range(start, len(doc)):
+            yield page_num, page_text(doc.load_page(page_num))
+
+
+# One pool for the whole process, created on first use: concurrent uploads queue their shards on the same
+# EXTRACT_WORKERS processes instead of each starting their own
+_pool = None
+_pool_lock = threading.Lock()
+# In a worker process: the PDF it has open, kept while consecutive shards come from the same file
+_worker_doc = None
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the Streamlit process already runs threads, which fork does not copy safely
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def _extract_page_range(path, start, stop):
+    global _worker_doc
+    if _worker_doc is None or _worker_doc[0] != path:
+        if _worker_doc is not None:
+            _worker_doc[1].close()
+        _worker_doc = (path, fitz.open(path))
+    doc = _worker_doc[1]
+    return [page_text(doc.load_page(page_num)) for page_num in range(start, stop)]
+
+
+def iter_pages(pdf_bytes, workers=EXTRACT_WORKERS):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_count = len(doc)
+    # Starting worker processes costs more than extracting a short document serially
+    if workers <= 1 or page_count < PARALLEL_MIN_PAGES:
+        yield from iter_pages_serial(pdf_bytes)
+        return
+    shards = ((start, min(start + PAGES_PER_SHARD, page_count)) for start in range(0, page_count, PAGES_PER_SHARD))
+    # Workers read the PDF from a temporary file rather than having the bytes pickled with every shard
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(pdf_bytes)
+    pool = _get_pool()
+    pending = deque()
+    try:
+        # Only a few shards are in flight, so memory stays flat however far the consumer falls behind
+        for start, stop in islice(shards, workers * 2):
+            pending.append((start, pool.submit(_extract_page_range, f.name, start, stop)))
+        while pending:
+            start, future = pending.popleft()
+            texts = future.result()
+            for next_start, next_stop in islice(shards, 1):
+                pending.append((next_start, pool.submit(_extract_page_range, f.name, next_start, next_stop)))
+            for i, text in enumerate(texts):
+                yield start + i, text
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise
+    finally:
+        for _, future in pending:
+            future.cancel()
+        with contextlib.suppress(OSError):
+            os.unlink(f.name)
+
+
+def is_heading(block):
+    # A short single line without closing punctuation, e.g. "2.1 Photosynthesis"
+    return "\n" not in block and len(block.split()) <= 12 and not block.rstrip().endswith((".", ",", ";", ":", "?", "!"))
+
+
+def iter_blocks(text):
+    # page_text separates PyMuPDF's text blocks with blank lines, each block is roughly a paragraph
+    offset = 0
+    for raw in re.split(r"\n\s*\n", text):
+        start = text.find(raw, offset)
+        offset = start + len(raw)
+        block = raw.strip()
+        if block:
+            yield start + raw.find(block), block
+
+
+def iter_sentences(block, max_tokens):
+    # Yields (offset, sentence): sentences have their whitespace collapsed, offset is where the sentence's
+    # first word starts in block
+    words = [(match.start(), match.group()) for match in re.finditer(r"\S+", block)]
+    paragraph = " ".join(word for _, word in words)
+    index = 0
+    # The split only removes the single spaces between sentences, so sentences take the words in order
+    for sentence in _SENTENCE_RE.split(paragraph):
+        sentence_words = sentence.split()
+        if not sentence_words:
+            continue
+        if count_tokens(sentence) <= max_tokens:
+            yield words[index][0], sentence
+            index += len(sentence_words)
+            continue
+        # A single sentence longer than a whole chunk is split on word boundaries
+        part = []
+        for word in sentence_words:
+            part.append(word)
+            if count_tokens(" ".join(part)) >= max_tokens:
+                yield words[index][0], " ".join(part)
+                index += len(part)
+                part = []
+        if part:
+            yield words[index][0], " ".join(part)
+            index += len(part)
+
+
+def chunk_page(page_num, text, chunk_tokens=CHUNK_TOKENS, overlap_tokens=OVERLAP_TOKENS):
+    # offset is where the chunk's first sentence starts in the page text, or its heading for a heading alone
+    part_num = 1
+    # (offset in text, sentence) pairs of the chunk being built
+    sentences = []
+    size = 0
+    heading = None
+    heading_offset = 0
+    heading_tokens = 0
+    # Whether the current section has a paragraph yet, not just short lines
+    has_prose = False
+
+    def make_chunk():
+        body = " ".join(sentence for _, sentence in sentences)
+        # Repeat the section heading in every chunk of the section so it is retrievable on its own
+        snippet = "\n".join(part for part in (heading, body) if part)
+        return {"title": f"Page {page_num + 1} Part {part_num}", "snippet": snippet,
+                "page": page_num + 1, "offset": sentences[0][0] if sentences else heading_offset,
+                "section": heading or ""}
+
+    for block_offset, block in iter_blocks(text):
+        # Short lines right under a heading (a list of terms, table cells, captions, equations) are
+        # text of that section rather than headings of their own, otherwise they would never be emitted
+        if is_heading(block) and (heading is None or has_prose):
+            # A new heading always starts a new chunk, without overlap from the previous section
+            if sentences:
+                yield make_chunk()
+                part_num += 1
+            sentences, size, heading, heading_offset = [], 0, block, block_offset
+            heading_tokens = count_tokens(block)
+            has_prose = False
+            continue
+        has_prose = has_prose or not is_heading(block)
+        for sentence_offset, sentence in iter_sentences(block, chunk_tokens):
+            tokens = count_tokens(sentence)
+            if sentences and heading_tokens + size + tokens > chunk_tokens:
+                yield make_chunk()
+                part_num += 1
+                # Carry the trailing sentences that fit in the overlap budget into the next chunk
+                carried = []
+                carried_size = 0
+                for previous in reversed(sentences):
+                    previous_tokens = count_tokens(previous[1])
+                    if carried_size + previous_tokens > overlap_tokens:
+                        break
+                    carried.insert(0, previous)
+                    carried_size += previous_tokens
+                sentences, size = carried, carried_size
+            sentences.append((block_offset + sentence_offset, sentence))
+            size += tokens
+    # A heading with nothing after it, like a title page or a trailing caption, still becomes a chunk
+    if sentences or heading:
+        yield make_chunk()
+
+
+def chunk_pages(pages, chunk_tokens=CHUNK_TOKENS, overlap_tokens=OVERLAP_TOKENS):
+    # Chunks never cross pages, so every chunk can be cited by a single page number
+    for page_num, text in pages:
+        yield from chunk_page(page_num, text, chunk_tokens, overlap_tokens)
+
+
+def iter_pdf_chunks(pdf_bytes, chunk_tokens=CHUNK_TOKENS, overlap_tokens=OVERLAP_TOKENS):
+    return chunk_pages(iter_pages(pdf_bytes), chunk_tokens, overlap_tokens)
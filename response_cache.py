@@ -0,0 +1,93 @@
+# Cache for summaries and answers, shared by every session of the process
+# Entries are keyed on (source content hash, preamble, normalised query); with query vectors, a
+# near-identical question about the same sources and level is also answered from the cache
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+MAX_ENTRIES = 2048
+TTL_SECONDS = 24 * 3600
+SIMILARITY = 0.95
+
+
+def normalize_query(query):
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+
+def scope_key(source_key, preamble):
+    return hashlib.sha256(f"{source_key}\0{preamble}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS, similarity=SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        # (scope, normalised query) -> (created, text, unit query vector or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {"entries": len(self._entries), "hits": self.hits, "semantic_hits": self.semantic_hits,
+                    "misses": self.misses, "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0}
+
+    def _expire(self, now):
+        while self._entries:
+            key, (created, _, _) = next(iter(self._entries.items()))
+            # Entries are kept in insertion and use order, but only the front can be checked cheaply
+            if now - created <= self.ttl:
+                break
+            del self._entries[key]
+
+    def get(self, source_key, preamble, query, query_vector=None):
+        scope = scope_key(source_key, preamble)
+        key = (scope, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if query_vector is not None:
+                match = self._nearest(scope, query_vector, now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.semantic_hits += 1
+                    return self._entries[match][1]
+            self.misses += 1
+            return None
+
+    def _nearest(self, scope, query_vector, now):
+        candidates = [(key, vector) for key, (created, _, vector) in self._entries.items()
+                      if key[0] == scope and vector is not None and now - created <= self.ttl]
+        if not candidates:
+            return None
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        scores = np.stack([vector for _, vector in candidates]) @ query
+        best = int(np.argmax(scores))
+        return candidates[best][0] if scores[best] >= self.similarity else None
+
+    def put(self, source_key, preamble, query, text, query_vector=None):
+        key = (scope_key(source_key, preamble), normalize_query(query))
+        vector = None
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1)
+        with self._lock:
+            self._entries[key] = (time.time(), text, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,201 @@
+# One retrieval pass over every source of a session: BM25 and vector search over the shared store,
+# fused with reciprocal rank fusion, deduplicated, optionally reranked and cut to a token budget
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+from history import text_key
+from pdf_ingest import count_tokens
+
+
+CANDIDATES = 20
+TOKEN_BUDGET = 1500
+RRF_K = 60
+# Documents kept in the in-memory BM25 index, least recently searched ones are dropped beyond this
+BM25_DOCUMENTS = 64
+
+_WORD_RE = re.compile(r"\w+")
+_STOPWORDS = {"a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "of", "on", "or",
+              "that", "the", "this", "to", "was", "were", "what", "with"}
+
+
+def tokenize(text):
+    return [word for word in _WORD_RE.findall(text.lower()) if word not in _STOPWORDS]
+
+
+class BM25Index:
+    # Inverted index over the chunks of recently used documents, keyed by the vector store's row ids so
+    # lexical and vector hits for the same chunk can be fused. Holds at most max_documents documents and
+    # drops the least recently searched one beyond that; a dropped document is added again when needed.
+    def __init__(self, k1=1.5, b=0.75, max_documents=BM25_DOCUMENTS):
+        self.k1 = k1
+        self.b = b
+        self.max_documents = max_documents
+        self._postings = defaultdict(dict)
+        self._lengths = {}
+        self._doc_of = {}
+        self._chunks = {}
+        # doc_id -> (chunk keys, terms), in least recently used order
+        self._documents = OrderedDict()
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, doc_id):
+        return doc_id in self._documents
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, doc_id, chunks):
+        if doc_id in self._documents:
+            return
+        # Tokenized before taking the lock, so searches are not held up by a large document
+        counted = [(chunk, Counter(tokenize(chunk.page_content))) for chunk in chunks]
+        with self._lock:
+            if doc_id in self._documents:
+                return
+            terms_of_doc = set()
+            for chunk, terms in counted:
+                for term, tf in terms.items():
+                    self._postings[term][chunk.id] = tf
+                terms_of_doc.update(terms)
+                length = sum(terms.values())
+                self._lengths[chunk.id] = length
+                self._total_length += length
+                self._doc_of[chunk.id] = doc_id
+                self._chunks[chunk.id] = chunk
+            self._documents[doc_id] = ([chunk.id for chunk, _ in counted], terms_of_doc)
+            while len(self._documents) > self.max_documents:
+                self._remove(next(iter(self._documents)))
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        # Called with _lock held
+        if doc_id not in self._documents:
+            return
+        keys, terms = self._documents.pop(doc_id)
+        for key in keys:
+            self._total_length -= self._lengths.pop(key)
+            del self._doc_of[key]
+            del self._chunks[key]
+        for term in terms:
+            postings = self._postings[term]
+            for key in keys:
+                postings.pop(key, None)
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query, k, doc_ids=None):
+        allowed = set(doc_ids) if doc_ids is not None else None
+        with self._lock:
+            for doc_id in allowed or ():
+                if doc_id in self._documents:
+                    self._documents.move_to_end(doc_id)
+            count = len(self._lengths)
+            if count == 0:
+                return []
+            average = self._total_length / count
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    if allowed is not None and self._doc_of[key] not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[key] / average)
+                    scores[key] += idf * tf * (self.k1 + 1) / (tf + norm)
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(self._chunks[key], score) for key, score in best]
+
+
+def reciprocal_rank_fusion(*rankings, k=RRF_K):
+    scores = defaultdict(float)
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            scores[doc.id] += 1 / (k + rank + 1)
+            docs.setdefault(doc.id, doc)
+    return [docs[key] for key, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
+
+
+def is_duplicate(words, kept_words, threshold=0.8):
+    # Neighbouring chunks overlap by a few sentences, near-total containment means the same passage
+    for other in kept_words:
+        smaller = min(len(words), len(other)) or 1
+        if len(words & other) / smaller >= threshold:
+            return True
+    return False
+
+
+def deduplicate(docs):
+    kept = []
+    kept_words = []
+    for doc in docs:
+        words = set(tokenize(doc.page_content))
+        if not is_duplicate(words, kept_words):
+            kept.append(doc)
+            kept_words.append(words)
+    return kept
+
+
+def within_budget(docs, token_budget):
+    # Always keeps the best document, even when it alone exceeds the budget
+    selected = []
+    used = 0
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if selected and used + tokens > token_budget:
+            break
+        selected.append(doc)
+        used += tokens
+    return selected
+
+
+class CohereReranker:
+    def __init__(self, client, model="rerank-english-v3.0"):
+        self.client = client
+        self.model = model
+
+    def __call__(self, query, docs):
+        if not docs:
+            return docs
+        response = self.client.rerank(model=self.model, query=query, documents=[doc.page_content for doc in docs])
+        return [docs[result.index] for result in response.results]
+
+
+class UnifiedRetriever:
+    # store is a LocalVectorStore view carrying the session's embeddings, bm25 the shared BM25Index,
+    # reranker any callable (query, docs) -> docs in the new order
+    def __init__(self, store, bm25, reranker=None, candidates=CANDIDATES, token_budget=TOKEN_BUDGET):
+        self.store = store
+        self.bm25 = bm25
+        self.reranker = reranker
+        self.candidates = candidates
+        self.token_budget = token_budget
+
+    def retrieve(self, query, doc_ids, query_vector=None, exclude=()):
+        # exclude holds history.text_key values of passages the model has already seen
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return []
+        # Builds add their document to the lexical index when they complete. This only catches documents
+        # completed by another process, or dropped from the index since.
+        for doc_id in doc_ids:
+            if doc_id not in self.bm25 and self.store.storage.is_complete(doc_id):
+                self.bm25.add(doc_id, self.store.storage.chunks(doc_id))
+        if query_vector is None:
+            query_vector = self.store.embedding.embed_query(query)
+        vector_hits = [doc for doc, _ in self.store.similarity_search_by_vector_with_score(query_vector, self.candidates, doc_ids)]
+        lexical_hits = [doc for doc, _ in self.bm25.search(query, self.candidates, doc_ids)]
+        docs = deduplicate(reciprocal_rank_fusion(vector_hits, lexical_hits))
+        if exclude:
+            docs = [doc for doc in docs if text_key(doc.page_content) not in exclude]
+        if self.reranker is not None:
+            docs = self.reranker(query, docs)
+        return within_budget(docs, self.token_budget)
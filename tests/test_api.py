@@ -0,0 +1,39 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from engine import GREETING
+from fake_cohere import FakeChatClient
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api.engine, "client", lambda api_key: FakeChatClient(first_token_latency=0, token_latency=0, latency=0))
+    return TestClient(api.app)
+
+
+def ask(client, **body):
+    return client.post("/ask", json=dict(message="What is energy?", **body), headers={"X-Cohere-Api-Key": "key"})
+
+
+def test_history_state_round_trips(client):
+    first = ask(client).json()
+    second = ask(client, messages=first["messages"], history=first["history"])
+    assert second.status_code == 200
+    assert len(second.json()["messages"]) == 5
+
+
+def test_malformed_history_is_rejected(client):
+    assert ask(client, history={"folded": -1}).status_code == 422
+    assert ask(client, history={"sent_documents": {"x": []}}).status_code == 422
+
+
+def test_client_cannot_choose_the_token_budget(client):
+    history = api.load_history(api.HistoryState.model_validate({"token_budget": 10**9}), [{"role": "Chatbot", "text": GREETING}])
+    assert history.token_budget == api.ChatHistory().token_budget
+
+
+def test_transcript_without_greeting_skips_nothing():
+    messages = [{"role": "User", "text": "Hi"}, {"role": "Chatbot", "text": "Hello"}]
+    assert api.load_history(None, messages).skip == 0
+    assert api.load_history(None, [{"role": "Chatbot", "text": GREETING}] + messages).skip == 1
@@ -0,0 +1,43 @@
+import json
+
+import cohere
+import httpx
+import pytest
+from langchain_core.documents import Document
+
+from embedding_pipeline import build_index, is_rate_limited
+from engine import CohereEmbedder
+
+
+def sdk_client(statuses, requests):
+    # A real cohere.Client talking to an in-process transport that answers with the given statuses in turn
+    statuses = iter(statuses)
+
+    def handler(request):
+        requests.append(request)
+        if next(statuses) == 429:
+            return httpx.Response(429, json={"message": "Too many requests"})
+        texts = json.loads(request.content)["texts"]
+        return httpx.Response(200, json={"id": "1", "texts": texts, "response_type": "embeddings_by_type",
+                                         "embeddings": {"float": [[1.0, 0.0, 0.5] for _ in texts]}})
+
+    return cohere.Client(api_key="key", httpx_client=httpx.Client(transport=httpx.MockTransport(handler)))
+
+
+def test_sdk_does_not_retry_rate_limits_itself():
+    requests = []
+    embedder = CohereEmbedder(sdk_client([429, 200], requests), "embed-english-v3.0")
+    with pytest.raises(Exception) as error:
+        embedder.embed_query("energy")
+    assert is_rate_limited(error.value)
+    assert len(requests) == 1
+
+
+def test_rate_limits_reach_the_shared_gate():
+    requests = []
+    embedder = CohereEmbedder(sdk_client([429, 429, 200], requests), "embed-english-v3.0")
+    documents = [Document(page_content=f"chunk {i}") for i in range(3)]
+    build = build_index(documents, embedder, base_delay=0.01).wait()
+    assert build.gate.retries == 2
+    assert build.done == 3
+    assert len(requests) == 3
@@ -0,0 +1,29 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def test_vectors_round_trip_as_float32(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    cache.put_many(["a", "b"], [[0.5, -1.25, 3.0], [1.0, 2.0, 3.0]])
+    assert cache.get_many(["b", "missing", "a"]) == [[1.0, 2.0, 3.0], None, [0.5, -1.25, 3.0]]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_entries=3)
+    cache.put_many(["a", "b", "c"], [[1.0]] * 3)
+    cache.get_many(["a"])
+    cache.put_many(["d"], [[2.0]])
+    assert cache.get_many(["a", "b", "c", "d"]) == [[1.0], None, [1.0], [2.0]]
+
+
+def test_totals_follow_replaced_entries(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    cache = EmbeddingCache(path, max_bytes=64)
+    cache.put_many(["a", "a", "b"], [np.ones(4), np.ones(4), np.ones(4)])
+    cache.put_many(["b"], [np.ones(4)])
+    assert cache._conn.execute("SELECT count, size FROM totals").fetchone() == (2, 32)
+    # Reopening keeps the totals instead of recounting
+    assert EmbeddingCache(path)._conn.execute("SELECT count, size FROM totals").fetchone() == (2, 32)
+    cache.put_many(["c", "d", "e"], [np.ones(4)] * 3)
+    assert cache._conn.execute("SELECT count, size FROM totals").fetchone() == (4, 64)
@@ -0,0 +1,55 @@
+import time
+
+from langchain_core.documents import Document
+
+from embedding_pipeline import build_index
+from fake_cohere import FakeEmbeddings
+from vector_store import LocalVectorStore, VectorStorage
+
+
+def documents(count):
+    return (Document(page_content=f"chunk {i} about energy and motion") for i in range(count))
+
+
+class FailingEmbeddings(FakeEmbeddings):
+    def embed_documents(self, texts):
+        self._call()
+        raise ValueError("bad request")
+
+
+def test_documents_are_embedded_in_batches():
+    embeddings = FakeEmbeddings(latency=0)
+    build = build_index(documents(250), embeddings, batch_size=96).wait()
+    assert build.done == build.total == 250
+    assert embeddings.calls == 3
+
+
+def test_rate_limits_back_off_together():
+    embeddings = FakeEmbeddings(latency=0, max_calls_per_second=3)
+    build = build_index(documents(60), embeddings, batch_size=6, base_delay=0.2).wait()
+    assert build.done == 60
+    assert embeddings.rate_limited > 0
+    # Every 429 went through the build's shared gate
+    assert build.gate.retries == embeddings.rate_limited
+
+
+def test_other_errors_fail_the_build_without_retries():
+    embeddings = FailingEmbeddings(latency=0)
+    build = build_index(documents(10), embeddings, batch_size=96, base_delay=0.01)
+    build._finished.wait(5)
+    assert isinstance(build.error, ValueError)
+    assert embeddings.calls == 1
+    assert build.gate.retries == 0
+
+
+def test_index_answers_before_the_build_finishes(tmp_path):
+    embeddings = FakeEmbeddings(latency=0.2)
+    store = LocalVectorStore(VectorStorage(str(tmp_path)))
+    build = build_index(documents(40), embeddings, store=store, doc_id="doc", batch_size=2)
+    deadline = time.monotonic() + 5
+    while build.done == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not build.finished
+    assert build.vectorstore.similarity_search("energy", k=2)
+    build.wait()
+    assert build.done == 40
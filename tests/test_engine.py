@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+from engine import TutorEngine, TutorTurn
+from fake_cohere import FakeChatClient
+from history import ChatHistory
+from response_cache import ResponseCache
+
+
+class BrokenStreamClient:
+    # Sends one piece of the answer, then the connection drops
+    def chat_stream(self, **kwargs):
+        yield SimpleNamespace(event_type="stream-start")
+        yield SimpleNamespace(event_type="text-generation", text="Partial ans")
+        raise ConnectionError("connection reset")
+
+
+def make_turn(client, cache):
+    engine = SimpleNamespace(response_cache=cache)
+    messages = [{"role": "Chatbot", "text": "Hello"}]
+    chat_kwargs = dict(chat_history=[], message="What is energy?", documents=[], preamble="")
+    return TutorTurn(engine, client, "What is energy?", messages, ChatHistory(), chat_kwargs, None,
+                     ("source", "preamble", "What is energy?", None)), messages
+
+
+def test_failed_stream_is_not_cached():
+    cache = ResponseCache()
+    turn, messages = make_turn(BrokenStreamClient(), cache)
+    with pytest.raises(ConnectionError):
+        for _ in turn.stream():
+            pass
+    assert cache.get("source", "preamble", "What is energy?") is None
+    assert len(messages) == 1
+
+
+def test_cancelled_stream_is_kept_but_not_cached():
+    cache = ResponseCache()
+    turn, messages = make_turn(FakeChatClient(first_token_latency=0, token_latency=0), cache)
+    stream = turn.stream()
+    next(stream)
+    stream.close()
+    assert cache.get("source", "preamble", "What is energy?") is None
+    assert messages[-1]["role"] == "Chatbot"
+
+
+def test_finished_stream_is_cached():
+    cache = ResponseCache()
+    turn, messages = make_turn(FakeChatClient(first_token_latency=0, token_latency=0), cache)
+    text = "".join(turn.stream())
+    assert cache.get("source", "preamble", "What is energy?") == text
+
+
+def test_clients_are_reused_per_key_and_bounded():
+    engine = TutorEngine(max_clients=2)
+    first = engine.client("a")
+    assert engine.client("a") is first
+    assert engine.embeddings("a").embeddings is engine.embeddings("a", session="s").embeddings
+    engine.client("b")
+    engine.client("a")
+    engine.client("c")
+    assert list(engine._clients) == ["a", "c"]
+    assert engine.client("a") is first
@@ -0,0 +1,28 @@
+from history import ChatHistory, message_tokens
+
+
+def words(count, prefix):
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+def test_latest_exchange_is_always_sent_verbatim():
+    history = ChatHistory(token_budget=100)
+    messages = [{"role": "Chatbot", "text": "Hello"}]
+    for turn in range(8):
+        chat_history, _ = history.prepare(messages)
+        if turn:
+            assert chat_history[-2:] == messages[-2:]
+        messages.append({"role": "User", "text": words(5, f"q{turn}_")})
+        messages.append({"role": "Chatbot", "text": words(50, f"a{turn}_")})
+
+
+def test_older_turns_are_folded_within_budget():
+    history = ChatHistory(token_budget=100)
+    messages = [{"role": "Chatbot", "text": "Hello"}]
+    for turn in range(6):
+        messages.append({"role": "User", "text": words(5, f"q{turn}_")})
+        messages.append({"role": "Chatbot", "text": words(20, f"a{turn}_")})
+        chat_history, summary = history.prepare(messages)
+        assert chat_history[0]["role"] == "User"
+        assert sum(message_tokens(message) for message in chat_history) <= 100
+    assert summary
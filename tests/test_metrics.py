@@ -0,0 +1,56 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    enabled = metrics.ENABLED
+    metrics.reset()
+    yield
+    metrics.reset()
+    metrics.ENABLED = enabled
+
+
+def test_disabled_hooks_record_nothing():
+    metrics.enable(False)
+    assert metrics.span("retrieve", "s") is metrics._NOOP
+    with metrics.span("retrieve", "s") as fields:
+        assert fields is None
+    metrics.observe("chat", 1.0, "s")
+    metrics.count("tutor_cache_total", 1, "s", cache="response", result="hit")
+    metrics.time_to_first_token(0.2, "s")
+    assert metrics.render_prometheus() == "\n"
+    assert metrics.session_report("s") == {"spans": [], "counters": {}}
+
+
+def test_prometheus_text_format():
+    metrics.enable()
+    for seconds in (0.02, 0.3, 100):
+        metrics.observe("retrieve", seconds)
+    metrics.count("tutor_cache_total", 2, cache="embedding", result="hit")
+    lines = metrics.render_prometheus().splitlines()
+    assert "# TYPE tutor_cache_total counter" in lines
+    assert 'tutor_cache_total{cache="embedding",result="hit"} 2.0' in lines
+    assert "# TYPE tutor_stage_seconds histogram" in lines
+    buckets = {line.split('le="')[1].split('"')[0]: int(line.rsplit(" ", 1)[1])
+               for line in lines if line.startswith('tutor_stage_seconds_bucket{stage="retrieve"')}
+    # Buckets are cumulative and +Inf counts every observation, including the one above the largest bound
+    assert buckets["0.01"] == 0 and buckets["0.025"] == 1 and buckets["0.5"] == 2 and buckets["60"] == 2
+    assert list(buckets.values()) == sorted(buckets.values())
+    assert buckets["+Inf"] == 3
+    assert 'tutor_stage_seconds_count{stage="retrieve"} 3' in lines
+    assert any(line.startswith('tutor_stage_seconds_sum{stage="retrieve"} 100.32') for line in lines)
+
+
+def test_least_recently_active_session_is_dropped(monkeypatch):
+    metrics.enable()
+    monkeypatch.setattr(metrics, "MAX_SESSIONS", 2)
+    metrics.observe("chat", 1.0, "a")
+    metrics.observe("chat", 1.0, "b")
+    metrics.count("tutor_tokens_total", 5, "a", kind="prompt")
+    metrics.observe("chat", 1.0, "c")
+    assert metrics.session_report("b") == {"spans": [], "counters": {}}
+    report = metrics.session_report("a")
+    assert [span["stage"] for span in report["spans"]] == ["chat"]
+    assert report["counters"] == {"tutor_tokens_total{kind=prompt}": 5}
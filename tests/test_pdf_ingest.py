@@ -0,0 +1,83 @@
+import pytest
+
+from pdf_ingest import chunk_page, iter_blocks
+
+
+PAGES = [
+    "Key Terms\n\nPhotosynthesis\n\nChlorophyll\n\nE = mc2\n\nStomata\n\nThe plant absorbs light through its leaves.",
+    "Intro\n\nCells are the basic unit of life.\n\nFigure 3",
+    "Title Page",
+    "2.1 Energy\n\n" + " ".join(f"Sentence number {i} talks about energy." for i in range(80))
+    + "\n\nTable 1\n\nMass\n\nVelocity\n\n2.2 Motion\n\nObjects keep moving unless a force acts on them.",
+    "A paragraph without any heading. It has two sentences.\n\nA heading after it\n\nCaption one\n\nCaption two",
+]
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+@pytest.mark.parametrize("text", PAGES)
+def test_every_block_ends_up_in_a_chunk(text):
+    snippets = [normalize(chunk["snippet"]) for chunk in chunk_page(0, text, chunk_tokens=64, overlap_tokens=8)]
+    for _, block in iter_blocks(text):
+        for sentence in block.split(". "):
+            assert any(normalize(sentence) in snippet for snippet in snippets), sentence
+
+
+def test_short_lines_under_a_heading_stay_in_its_section():
+    chunks = list(chunk_page(0, PAGES[0]))
+    assert len(chunks) == 1
+    assert chunks[0]["section"] == "Key Terms"
+    assert "Photosynthesis Chlorophyll E = mc2 Stomata" in chunks[0]["snippet"]
+
+
+def make_pdf(pages):
+    import fitz
+    doc = fitz.open()
+    for page_num in range(pages):
+        doc.new_page().insert_text((72, 72), f"Page {page_num} is about cells and energy.")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_parallel_extraction_matches_serial_and_submits_a_window(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import pdf_ingest
+
+    submitted = []
+
+    class CountingPool(ThreadPoolExecutor):
+        def submit(self, fn, *args):
+            submitted.append(args[1])
+            return super().submit(fn, *args)
+
+    pool = CountingPool(max_workers=1)
+    monkeypatch.setattr(pdf_ingest, "_get_pool", lambda: pool)
+    monkeypatch.setattr(pdf_ingest, "PARALLEL_MIN_PAGES", 1)
+    monkeypatch.setattr(pdf_ingest, "PAGES_PER_SHARD", 2)
+    data = make_pdf(20)
+    pages = pdf_ingest.iter_pages(data, workers=2)
+    first = next(pages)
+    # Ten shards in total, but only the window of workers * 2 plus the one refilled after the first result
+    assert len(submitted) == 5
+    assert [first] + list(pages) == list(pdf_ingest.iter_pages_serial(data))
+    assert len(submitted) == 10
+    pool.shutdown()
+
+
+def test_extraction_pool_is_shared():
+    import pdf_ingest
+
+    assert pdf_ingest._get_pool() is pdf_ingest._get_pool()
+
+
+@pytest.mark.parametrize("text", PAGES)
+def test_offset_points_at_the_chunks_first_sentence(text):
+    for chunk in chunk_page(0, text, chunk_tokens=64, overlap_tokens=8):
+        body = chunk["snippet"].split("\n", 1)[1] if chunk["section"] and "\n" in chunk["snippet"] else chunk["snippet"]
+        first_word = body.split()[0]
+        assert text[chunk["offset"]:].startswith(first_word)
+        assert normalize(text[chunk["offset"]:]).startswith(body.split(". ")[0])
@@ -0,0 +1,37 @@
+import response_cache
+from response_cache import ResponseCache
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(ttl=60)
+    cache.put("source", "preamble", "What is energy?", "Energy is...")
+    now[0] += 59
+    assert cache.get("source", "preamble", "what is ENERGY") == "Energy is..."
+    now[0] += 2
+    assert cache.get("source", "preamble", "What is energy?") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put("source", "", "a", "A")
+    cache.put("source", "", "b", "B")
+    cache.get("source", "", "a")
+    cache.put("source", "", "c", "C")
+    assert cache.get("source", "", "a") == "A"
+    assert cache.get("source", "", "b") is None
+    assert cache.get("source", "", "c") == "C"
+
+
+def test_similar_questions_hit_above_the_threshold_only():
+    cache = ResponseCache(similarity=0.95)
+    cache.put("source", "", "What is energy?", "Energy is...", [1.0, 0.0])
+    # cos = 0.98 and 0.89 against the stored vector
+    assert cache.get("source", "", "Define energy", [0.98, 0.199]) == "Energy is..."
+    assert cache.get("source", "", "Define power", [0.89, 0.456]) is None
+    # A different source or preamble never matches, however close the question
+    assert cache.get("other", "", "Define energy", [1.0, 0.0]) is None
+    assert cache.get("source", "kids", "Define energy", [1.0, 0.0]) is None
+    assert cache.stats()["semantic_hits"] == 1
@@ -0,0 +1,50 @@
+from langchain_core.documents import Document
+
+from retrieval import BM25Index
+
+
+def chunks(doc_id, texts):
+    return [Document(id=f"{doc_id}-{i}", page_content=text) for i, text in enumerate(texts)]
+
+
+def test_least_recently_searched_document_is_dropped():
+    index = BM25Index(max_documents=2)
+    index.add("a", chunks("a", ["photosynthesis in plants"]))
+    index.add("b", chunks("b", ["velocity and acceleration"]))
+    index.search("plants", 5, ["a"])
+    index.add("c", chunks("c", ["enzymes speed up reactions"]))
+    assert "a" in index and "c" in index and "b" not in index
+    assert len(index) == 2
+    assert index.search("velocity", 5) == []
+    assert [doc.id for doc, _ in index.search("enzymes", 5)] == ["c-0"]
+
+
+def test_remove_drops_every_posting():
+    index = BM25Index()
+    index.add("a", chunks("a", ["photosynthesis in plants", "plants need light"]))
+    index.remove("a")
+    assert index.search("plants", 5) == []
+    assert not index._postings and not index._chunks and index._total_length == 0
+
+
+def test_already_sent_passages_are_replaced_not_dropped(tmp_path):
+    from fake_cohere import FakeEmbeddings
+    from history import text_key
+    from retrieval import UnifiedRetriever
+    from vector_store import LocalVectorStore, VectorStorage
+
+    texts = ["Enzymes lower the activation energy of digestion in the stomach and gut.",
+             "Amylase is an enzyme that breaks starch into sugars, needing less activation energy.",
+             "Catalase protects cells by splitting hydrogen peroxide; enzymes speed this up.",
+             "Temperature and pH change enzyme shape, which changes the activation energy barrier.",
+             "Inhibitors block the active site so enzymes cannot lower activation energy.",
+             "Photosynthesis relies on enzymes such as rubisco to fix carbon dioxide."]
+    store = LocalVectorStore(VectorStorage(str(tmp_path)), FakeEmbeddings(latency=0), ["doc"])
+    store.add_texts(texts, doc_id="doc")
+    store.storage.mark_complete("doc")
+    retriever = UnifiedRetriever(store, BM25Index(), token_budget=40)
+    first = retriever.retrieve("enzymes activation energy", ["doc"])
+    second = retriever.retrieve("enzymes activation energy", ["doc"],
+                                exclude={text_key(doc.page_content) for doc in first})
+    assert len(second) == len(first)
+    assert not {doc.page_content for doc in first} & {doc.page_content for doc in second}
@@ -0,0 +1,63 @@
+from langchain_core.documents import Document
+
+from embedding_pipeline import build_index
+from fake_cohere import FakeEmbeddings
+from vector_store import LocalVectorStore, VectorStorage
+
+
+def documents(count=400):
+    return (Document(page_content=f"chunk {i} about energy and motion") for i in range(count))
+
+
+class BrokenEmbeddings(FakeEmbeddings):
+    def embed_documents(self, texts):
+        raise ValueError("embedding failed")
+
+
+def test_two_processes_building_the_same_document_write_it_once(tmp_path):
+    # Two VectorStorage instances on one directory stand in for two API workers
+    first = LocalVectorStore(VectorStorage(str(tmp_path)))
+    second = LocalVectorStore(VectorStorage(str(tmp_path)))
+    embeddings = FakeEmbeddings(latency=0.01)
+    builds = [build_index(documents(), embeddings, store=store, doc_id="doc") for store in (first, second)]
+    for build in builds:
+        build.wait()
+    assert len(first.storage.chunks("doc")) == 400
+    assert first.storage.is_complete("doc") and second.storage.is_complete("doc")
+
+
+def test_failed_build_releases_its_claim(tmp_path):
+    store = LocalVectorStore(VectorStorage(str(tmp_path)))
+    failed = build_index(documents(10), BrokenEmbeddings(latency=0), store=store, doc_id="doc")
+    failed._finished.wait()
+    assert failed.error is not None
+    assert store.storage.claim("doc", "next-builder") == "claimed"
+
+
+def test_claim_is_refused_while_another_builder_is_alive(tmp_path):
+    storage = VectorStorage(str(tmp_path))
+    assert storage.claim("doc", "a") == "claimed"
+    assert storage.claim("doc", "b") == "building"
+    assert storage.claim("doc", "b", stale_after=0) == "claimed"
+    storage.mark_complete("doc", "b")
+    assert storage.claim("doc", "a") == "complete"
+
+
+def test_search_ignores_rows_another_process_is_still_writing(tmp_path):
+    storage = VectorStorage(str(tmp_path), quantize=True)
+    storage.add("doc", ["energy", "motion"], [{}, {}], [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    # Another process inside add() has written its int8 vectors but not yet their scales
+    with open(storage.vectors_path, "ab") as f:
+        f.write(bytes(3 * 5))
+    results = VectorStorage(str(tmp_path)).search([1.0, 0.0, 0.0], 1, ["doc"])
+    assert [doc.page_content for doc, _ in results] == ["energy"]
+
+
+def test_failed_delete_does_not_leave_a_transaction_open(tmp_path):
+    storage = VectorStorage(str(tmp_path))
+    try:
+        storage.delete([object()])
+    except Exception:
+        pass
+    assert not storage._conn.in_transaction
+    storage.add("doc", ["energy"], [{}], [[1.0, 0.0]])
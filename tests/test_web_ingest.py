@@ -0,0 +1,59 @@
+import functools
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from web_ingest import NotHTMLError, PageCache, crawl, fetch_page, load_websites, make_session
+
+
+SITE = os.path.join(os.path.dirname(__file__), "fixtures", "site")
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    requested = []
+
+    def do_GET(self):
+        QuietHandler.requested.append(self.path)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    # Serves tests/fixtures/site; SimpleHTTPRequestHandler sends Last-Modified and answers If-Modified-Since with 304
+    QuietHandler.requested = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=SITE))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_crawl_only_indexes_html_pages(site, tmp_path):
+    pages = crawl([f"{site}/index.html"], depth=1, session=make_session(), cache=PageCache(str(tmp_path / "pages.sqlite3")))
+    assert sorted(page["url"] for page in pages) == [f"{site}/about.html", f"{site}/index.html"]
+    # Links with non-HTML extensions are never requested, other links are dropped on their Content-Type
+    assert "/notes.pdf" not in QuietHandler.requested
+    assert "/diagram.png" not in QuietHandler.requested
+    assert "/download" in QuietHandler.requested
+    documents = load_websites([f"{site}/index.html"], depth=1, session=make_session(),
+                              cache=PageCache(str(tmp_path / "pages.sqlite3")))
+    assert not any("%PDF" in document.page_content for document in documents)
+
+
+def test_non_html_start_url_is_an_error(site, tmp_path):
+    with pytest.raises(NotHTMLError):
+        fetch_page(make_session(), PageCache(str(tmp_path / "pages.sqlite3")), f"{site}/download")
+
+
+def test_unchanged_page_comes_back_from_the_cache(site, tmp_path):
+    session, cache = make_session(), PageCache(str(tmp_path / "pages.sqlite3"))
+    first = fetch_page(session, cache, f"{site}/about.html")
+    second = fetch_page(session, cache, f"{site}/about.html")
+    assert first["modified"] and not second["modified"]
+    assert second["text"] == first["text"]
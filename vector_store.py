@@ -0,0 +1,288 @@
+# Persistent local vector store shared by every session (and every process) using the same directory
+# Vectors live in one contiguous memory-mapped file (float32, or int8 with a per-row scale), chunk text
+# and metadata in SQLite. Search is a single matrix-vector product over the rows of the requested documents.
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from embedding_cache import CACHE_DIR
+
+
+# A build whose owner has not written anything for this long is considered dead and can be taken over
+STALE_AFTER = 300
+
+
+class VectorStorage:
+    def __init__(self, directory=None, quantize=False):
+        self.directory = directory or os.path.join(CACHE_DIR, "vectors")
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.directory, "chunks.sqlite3"), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id)")
+        # complete = 0 while a build owned by owner is running, heartbeat is when that owner last wrote
+        self._conn.execute("CREATE TABLE IF NOT EXISTS documents ("
+                           "doc_id TEXT PRIMARY KEY, complete INTEGER NOT NULL, owner TEXT, heartbeat REAL)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+        for column, kind in (("owner", "TEXT"), ("heartbeat", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE documents ADD COLUMN {column} {kind}")
+        # The first process to create the store decides whether it is quantised
+        self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('quantize', ?)", (json.dumps(quantize),))
+        self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('next_row', '0')")
+        self.quantize = json.loads(self._get_meta("quantize"))
+        self.dim = json.loads(self._get_meta("dim") or "null")
+        self.vectors_path = os.path.join(self.directory, "vectors.i8" if self.quantize else "vectors.f32")
+        self.scales_path = os.path.join(self.directory, "scales.f32")
+        self._vectors = None
+        self._scales = None
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _mapped(self, needed_rows):
+        # Other sessions or processes may have appended rows since the file was mapped. The maps are sized from
+        # the committed row count, not the files: a process half way through add() may already have grown
+        # vectors.i8 but not scales.f32, and every committed row is fully written to both.
+        if self._vectors is None or len(self._vectors) < needed_rows:
+            rows = int(self._get_meta("next_row"))
+            self._vectors = np.memmap(self.vectors_path, dtype=np.int8 if self.quantize else np.float32,
+                                      mode="r", shape=(rows, self.dim))
+            if self.quantize:
+                self._scales = np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(rows,))
+        return self._vectors, self._scales
+
+    def add(self, doc_id, texts, metadatas, vectors, owner=None):
+        # With an owner, the rows are only added while that owner still holds the document's build
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.dim is None:
+                    self.dim = json.loads(self._get_meta("dim") or "null") or vectors.shape[1]
+                    self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('dim', ?)", (json.dumps(self.dim),))
+                if vectors.shape[1] != self.dim:
+                    raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+                if owner is not None:
+                    self._check_owner(doc_id, owner)
+                # Reserve the rows first, the transaction keeps other processes from taking the same ones
+                start = int(self._get_meta("next_row"))
+                self._conn.execute("UPDATE meta SET value = ? WHERE key = 'next_row'", (str(start + len(vectors)),))
+                if self.quantize:
+                    scales = np.abs(vectors).max(axis=1) / 127
+                    scales[scales == 0] = 1
+                    self._write(self.vectors_path, start * self.dim, np.round(vectors / scales[:, None]).astype(np.int8))
+                    self._write(self.scales_path, start * 4, scales.astype(np.float32))
+                else:
+                    self._write(self.vectors_path, start * self.dim * 4, vectors)
+                # Rows only become searchable once their vectors are on disk
+                self._conn.executemany(
+                    "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                    [(start + i, doc_id, text, json.dumps(metadata or {}))
+                     for i, (text, metadata) in enumerate(zip(texts, metadatas))],
+                )
+                self._conn.execute("INSERT OR IGNORE INTO documents (doc_id, complete) VALUES (?, 0)", (doc_id,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [str(start + i) for i in range(len(vectors))]
+
+    def _write(self, path, offset, array):
+        mode = "r+b" if os.path.exists(path) else "wb"
+        with open(path, mode) as f:
+            f.seek(offset)
+            f.write(array.tobytes())
+
+    def _check_owner(self, doc_id, owner):
+        # Called inside a write transaction, so the claim cannot change before the transaction commits
+        row = self._conn.execute("SELECT owner FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        if row is None or row[0] != owner:
+            raise RuntimeError(f"The build of {doc_id} was taken over by another builder")
+        self._conn.execute("UPDATE documents SET heartbeat = ? WHERE doc_id = ?", (time.time(), doc_id))
+
+    def claim(self, doc_id, owner, stale_after=STALE_AFTER):
+        # Returns "complete", "building" when another live builder owns the document, or "claimed".
+        # Claiming drops whatever an earlier, interrupted build left behind.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT complete, owner, heartbeat FROM documents WHERE doc_id = ?",
+                                         (doc_id,)).fetchone()
+                if row is not None and row[0]:
+                    state = "complete"
+                elif (row is not None and row[1] is not None and row[1] != owner
+                      and time.time() - (row[2] or 0) < stale_after):
+                    state = "building"
+                else:
+                    self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+                    self._conn.execute("INSERT OR REPLACE INTO documents VALUES (?, 0, ?, ?)", (doc_id, owner, time.time()))
+                    state = "claimed"
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return state
+
+    def heartbeat(self, doc_id, owner):
+        with self._lock:
+            self._conn.execute("UPDATE documents SET heartbeat = ? WHERE doc_id = ? AND owner = ?",
+                               (time.time(), doc_id, owner))
+
+    def release(self, doc_id, owner):
+        # Gives up a failed build, so the next builder does not have to wait for it to go stale
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM chunks WHERE doc_id = ? AND EXISTS "
+                                   "(SELECT 1 FROM documents WHERE doc_id = ? AND owner = ? AND complete = 0)",
+                                   (doc_id, doc_id, owner))
+                self._conn.execute("DELETE FROM documents WHERE doc_id = ? AND owner = ? AND complete = 0", (doc_id, owner))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def mark_complete(self, doc_id, owner=None):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if owner is not None:
+                    self._check_owner(doc_id, owner)
+                self._conn.execute("INSERT OR REPLACE INTO documents VALUES (?, 1, NULL, NULL)", (doc_id,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def is_complete(self, doc_id):
+        with self._lock:
+            row = self._conn.execute("SELECT complete FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return bool(row and row[0])
+
+    def chunks(self, doc_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT row, text, metadata FROM chunks WHERE doc_id = ? ORDER BY row", (doc_id,)).fetchall()
+        return [Document(id=str(row), page_content=text, metadata=json.loads(metadata)) for row, text, metadata in rows]
+
+    def delete(self, doc_ids):
+        # The rows' vectors stay in the file as dead space, they are simply never selected again
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("DELETE FROM chunks WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+                self._conn.executemany("DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def search(self, query_vector, k, doc_ids=None):
+        with self._lock:
+            if self.dim is None:
+                self.dim = json.loads(self._get_meta("dim") or "null")
+                if self.dim is None:
+                    return []
+            if doc_ids is None:
+                rows = self._conn.execute("SELECT row FROM chunks").fetchall()
+            elif doc_ids:
+                placeholders = ",".join("?" * len(doc_ids))
+                rows = self._conn.execute(f"SELECT row FROM chunks WHERE doc_id IN ({placeholders})", list(doc_ids)).fetchall()
+            else:
+                rows = []
+            if not rows:
+                return []
+            rows = np.fromiter((row for row, in rows), dtype=np.int64, count=len(rows))
+            rows.sort()
+            vectors, scales = self._mapped(int(rows[-1]) + 1)
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        if self.quantize:
+            scores = (vectors[rows].astype(np.float32) @ query) * scales[rows]
+        else:
+            scores = vectors[rows] @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        found = {}
+        with self._lock:
+            placeholders = ",".join("?" * k)
+            for row, text, metadata in self._conn.execute(
+                f"SELECT row, text, metadata FROM chunks WHERE row IN ({placeholders})", [int(rows[i]) for i in top]
+            ):
+                found[row] = (text, json.loads(metadata))
+        results = []
+        for i in top:
+            row = int(rows[i])
+            if row in found:
+                text, metadata = found[row]
+                results.append((Document(id=str(row), page_content=text, metadata=metadata), float(scores[i])))
+        return results
+
+
+class LocalVectorStore(VectorStore):
+    # A view of a VectorStorage: doc_ids limits searches to some documents, embedding embeds the queries.
+    # Every session gets its own view with its own API key, the storage underneath is shared.
+    def __init__(self, storage, embedding=None, doc_ids=None, owner=None):
+        self.storage = storage
+        self.embedding = embedding
+        self.doc_ids = list(doc_ids) if doc_ids is not None else None
+        # Set on the view an index build writes through, see VectorStorage.claim
+        self.owner = owner
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def scoped(self, doc_ids, embedding=None, owner=None):
+        return LocalVectorStore(self.storage, embedding or self.embedding, doc_ids, owner)
+
+    def add_texts(self, texts, metadatas=None, doc_id=None, **kwargs):
+        texts = list(texts)
+        if doc_id is None:
+            if not self.doc_ids or len(self.doc_ids) != 1:
+                raise ValueError("add_texts needs a doc_id unless the store is scoped to a single document")
+            doc_id = self.doc_ids[0]
+        vectors = self.embedding.embed_documents(texts)
+        return self.storage.add(doc_id, texts, metadatas or [{} for _ in texts], vectors, self.owner)
+
+    def delete(self, ids=None, **kwargs):
+        # ids are document ids: every chunk of those documents is removed
+        self.storage.delete(ids if ids is not None else self.doc_ids or [])
+        return True
+
+    def similarity_search_with_score(self, query, k=4, doc_ids=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k, doc_ids)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, doc_ids=None):
+        return self.storage.search(embedding, k, doc_ids if doc_ids is not None else self.doc_ids)
+
+    def similarity_search(self, query, k=4, doc_ids=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, doc_ids)]
+
+    def similarity_search_by_vector(self, embedding, k=4, doc_ids=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, doc_ids)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, directory=None, doc_id="default", **kwargs):
+        store = cls(VectorStorage(directory), embedding, [doc_id])
+        store.add_texts(texts, metadatas, doc_id=doc_id)
+        return store
@@ -0,0 +1,163 @@
+# Concurrent website ingestion: several start URLs, optionally following same-site links to a depth limit,
+# fetched on a pooled HTTP session. ETag/Last-Modified are remembered so unchanged pages come back as a
+# cheap 304 and are not downloaded or parsed again.
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from posixpath import splitext
+from urllib.parse import urljoin, urldefrag, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from langchain_core.documents import Document
+from requests.adapters import HTTPAdapter
+
+from embedding_cache import CACHE_DIR
+from pdf_ingest import chunk_page
+
+
+FETCH_WORKERS = 8
+MAX_PAGES = 25
+TIMEOUT = 15
+
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+# Links to these are not queued at all, anything else is checked by its Content-Type before the body is read
+SKIP_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico", ".zip", ".gz", ".tar", ".tgz",
+                   ".7z", ".rar", ".mp3", ".mp4", ".wav", ".avi", ".mov", ".webm", ".doc", ".docx", ".xls", ".xlsx",
+                   ".ppt", ".pptx", ".csv", ".json", ".xml", ".txt", ".css", ".js", ".exe", ".dmg", ".woff", ".woff2", ".ttf"}
+
+try:
+    import lxml # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+
+class NotHTMLError(requests.RequestException):
+    pass
+
+
+def is_html_link(url):
+    return splitext(urlparse(url).path)[1].lower() not in SKIP_EXTENSIONS
+
+
+class PageCache:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "pages.sqlite3")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, title TEXT, text TEXT, links TEXT)"
+        )
+        self._conn.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT etag, last_modified, title, text, links FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, title, text, links = row
+        return {"etag": etag, "last_modified": last_modified, "title": title, "text": text, "links": json.loads(links)}
+
+    def put(self, url, page):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                               (url, page["etag"], page["last_modified"], page["title"], page["text"], json.dumps(page["links"])))
+            self._conn.commit()
+
+
+def make_session(workers=FETCH_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "LLM-PDF-Chatbot"
+    return session
+
+
+def parse_page(url, html):
+    soup = BeautifulSoup(html, PARSER)
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    title = soup.title.get_text(strip=True) if soup.title else url
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        link = urldefrag(urljoin(url, anchor["href"]))[0]
+        if urlparse(link).scheme in ("http", "https"):
+            links.append(link)
+    return title, soup.get_text(separator=" ", strip=True), links
+
+
+def fetch_page(session, cache, url):
+    cached = cache.get(url)
+    headers = {}
+    if cached is not None:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+    # Streamed, so a linked PDF, image or archive is rejected on its headers without downloading the body
+    with session.get(url, headers=headers, timeout=TIMEOUT, stream=True) as response:
+        if response.status_code == 304 and cached is not None:
+            return dict(cached, url=url, modified=False)
+        response.raise_for_status()
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type not in HTML_TYPES:
+            raise NotHTMLError(f"{url} is not an HTML page ({content_type or 'no Content-Type'})", response=response)
+        title, text, links = parse_page(response.url, response.text)
+    page = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified"),
+            "title": title, "text": text, "links": links}
+    if page["etag"] or page["last_modified"]:
+        cache.put(url, page)
+    return dict(page, url=url, modified=True)
+
+
+def fetch_or_skip(session, cache, url):
+    try:
+        return fetch_page(session, cache, url)
+    except requests.RequestException:
+        return None
+
+
+def crawl(urls, depth=0, max_pages=MAX_PAGES, session=None, cache=None, workers=FETCH_WORKERS):
+    # Breadth first: every level is fetched concurrently, links are only followed within the start URLs' sites
+    session = session or make_session(workers)
+    cache = cache or PageCache()
+    sites = {urlparse(url).netloc for url in urls}
+    seen = set(urls)
+    level = list(dict.fromkeys(urls))[:max_pages]
+    pages = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for current_depth in range(depth + 1):
+            if not level:
+                break
+            if current_depth == 0:
+                results = list(pool.map(lambda url: fetch_page(session, cache, url), level))
+            else:
+                # A broken link found on a page should not fail the whole crawl
+                results = [page for page in pool.map(lambda url: fetch_or_skip(session, cache, url), level) if page]
+            pages.extend(results)
+            next_level = []
+            if current_depth < depth:
+                for page in results:
+                    for link in page["links"]:
+                        if (link not in seen and urlparse(link).netloc in sites and is_html_link(link)
+                                and len(pages) + len(next_level) < max_pages):
+                            seen.add(link)
+                            next_level.append(link)
+            level = next_level
+    return pages
+
+
+def load_websites(urls, depth=0, max_pages=MAX_PAGES, session=None, cache=None):
+    # Pages are chunked like PDF pages, on sentence boundaries within the token budget
+    documents = []
+    for page in crawl(urls, depth, max_pages, session, cache):
+        for part_num, chunk in enumerate(chunk_page(0, page["text"]), 1):
+            documents.append(Document(page_content=chunk["snippet"],
+                                      metadata={"source": page["url"], "title": f"{page['title']} Part {part_num}"}))
+    return documents